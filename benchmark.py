@@ -0,0 +1,459 @@
+"""Замеры производительности модуля фитнес-трекера.
+
+    python benchmark.py run --sizes 1000 100000 --output current.json
+    python benchmark.py compare baseline.json current.json --threshold 0.1
+    python benchmark.py memory
+    python benchmark.py dispatch
+    python benchmark.py packed --size 1000000
+    python benchmark.py contention --threads 1 8 64
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import make_dataclass
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+import homework
+
+
+PACKAGES = {
+    'SWM': [720, 1, 80, 25, 40],
+    'RUN': [15000, 1, 75],
+    'WLK': [9000, 1, 75, 180],
+}
+
+
+def _allocated(build: Callable[[], object]) -> int:
+    """Вернуть число байт, занятых объектом, который создаёт build."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        keep = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del keep
+    return after - before
+
+
+def memory_per_record(count: int = 100_000) -> Dict[str, Dict[str, float]]:
+    """Сравнить размер одной записи в байтах для разных представлений.
+
+    objects — экземпляры с __dict__, slotted — варианты из SLOTTED_TYPES
+    и InfoMessage со __slots__, columnar — TrainingBatch на array('d').
+    Размер списка-контейнера входит в объём для объектов.
+    """
+    result = {}
+    for code, data in PACKAGES.items():
+        training_class = homework.WORKOUT_TYPES[code]
+        slotted_class = homework.SLOTTED_TYPES[code]
+        rows = [list(data) for _ in range(count)]
+        sizes = {
+            'objects': _allocated(
+                lambda: [training_class(*row) for row in rows]),
+            'slotted': _allocated(
+                lambda: [slotted_class(*row) for row in rows]),
+            'columnar': _allocated(
+                lambda: homework.TrainingBatch(code, rows)),
+        }
+        result[training_class.__name__] = {
+            name: size / count for name, size in sizes.items()
+        }
+    info = homework.read_package('RUN', PACKAGES['RUN']).show_training_info()
+    fields = [getattr(info, name) for name in homework.BATCH_COLUMNS]
+    dict_message = make_dataclass('InfoMessage', homework.BATCH_COLUMNS)
+    result['InfoMessage'] = {
+        'objects': _allocated(
+            lambda: [dict_message(*fields) for _ in range(count)]
+        ) / count,
+        'slotted': _allocated(
+            lambda: [homework.InfoMessage(*fields) for _ in range(count)]
+        ) / count,
+    }
+    return result
+
+
+def _legacy_read_package(workout_type, data):
+    """read_package до реестра: словарь собирался на каждый вызов."""
+    workout_type_dict = {
+        'SWM': homework.Swimming,
+        'WLK': homework.SportsWalking,
+        'RUN': homework.Running
+    }
+    return workout_type_dict.get(workout_type)(*data)
+
+
+def dispatch_cost(number: int = 200_000) -> Dict[str, Dict[str, float]]:
+    """Стоимость выбора класса и создания тренировки, нс на пакет."""
+    result = {}
+    for code, data in PACKAGES.items():
+        timings = {
+            'legacy': timeit.timeit(
+                lambda: _legacy_read_package(code, data), number=number),
+            'registry': timeit.timeit(
+                lambda: homework.read_package(code, data), number=number),
+            'lookup': timeit.timeit(
+                lambda: homework.WORKOUT_CONSTRUCTORS[code], number=number),
+        }
+        result[code] = {name: seconds / number * 1e9
+                        for name, seconds in timings.items()}
+    return result
+
+
+def _best_time(run: Callable[[], object], repeat: int) -> float:
+    """Минимальное время из repeat запусков run, в секундах."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _per_item(run: Callable[[int], object], count: int,
+              repeat: int) -> float:
+    """Время на один элемент в наносекундах."""
+    return _best_time(lambda: run(count), repeat) / count * 1e9
+
+
+def hot_paths(count: int = 20_000,
+              repeat: int = 5) -> Dict[str, float]:
+    """Стоимость отдельных шагов расчёта, нс на пакет.
+
+    Методы расчёта замеряются на свежих экземплярах, чтобы в замер
+    попадал первый (некэшированный) вызов.
+    """
+    result = {}
+    for code, data in PACKAGES.items():
+        training_class = homework.WORKOUT_TYPES[code]
+        name = training_class.__name__
+        result[f'read_package.{code}'] = _per_item(
+            lambda n: [homework.read_package(code, data) for _ in range(n)],
+            count, repeat)
+        result[f'construct.{name}'] = _per_item(
+            lambda n: [training_class(*data) for _ in range(n)],
+            count, repeat)
+        for method in ('get_distance', 'get_mean_speed',
+                       'get_spent_calories', 'show_training_info'):
+            def run(n: int, method: str = method) -> float:
+                trainings = [training_class(*data) for _ in range(n)]
+                started = time.perf_counter()
+                for training in trainings:
+                    getattr(training, method)()
+                return time.perf_counter() - started
+            result[f'{method}.{name}'] = min(
+                run(count) for _ in range(repeat)) / count * 1e9
+        info = training_class(*data).show_training_info()
+        result[f'get_message.{name}'] = _per_item(
+            lambda n: [info.get_message() for _ in range(n)], count, repeat)
+    return result
+
+
+def synthetic_packages(count: int, seed: int = 0
+                       ) -> Iterator[Tuple[str, List[float]]]:
+    """Лениво сгенерировать count случайных корректных пакетов."""
+    generator = random.Random(seed)
+    for _ in range(count):
+        code = generator.choice(('SWM', 'RUN', 'WLK'))
+        action = generator.randint(100, 30_000)
+        duration = generator.uniform(0.25, 3)
+        weight = generator.uniform(40, 120)
+        if code == 'SWM':
+            yield code, [action, duration, weight, generator.choice((25, 50)),
+                         generator.randint(4, 80)]
+        elif code == 'WLK':
+            yield code, [action, duration, weight,
+                         generator.uniform(140, 200)]
+        else:
+            yield code, [action, duration, weight]
+
+
+def _chunks(packages: Iterator, size: int) -> Iterator[list]:
+    while True:
+        chunk = list(islice(packages, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _scalar_pipeline(count: int) -> None:
+    for code, data in synthetic_packages(count):
+        homework.read_package(code, data).show_training_info().get_message()
+
+
+def _batch_pipeline(count: int, chunk_size: int = 100_000) -> None:
+    for chunk in _chunks(synthetic_packages(count), chunk_size):
+        columns = homework.compute_batch(*homework.packages_to_columns(chunk))
+        for _ in homework.format_messages(
+                homework.InfoMessage(*row) for row in zip(
+                    *(columns[name] for name in homework.BATCH_COLUMNS))):
+            pass
+
+
+def throughput(sizes: Sequence[int] = (1_000, 10_000, 100_000),
+               repeat: int = 3) -> Dict[str, float]:
+    """Пакетов в секунду для сквозной обработки синтетических данных.
+
+    Генерация пакетов входит в замер и одинакова для обоих путей;
+    данные генерируются лениво, так что 10**7 пакетов не требуют
+    памяти на весь набор.
+    """
+    result = {}
+    for size in sizes:
+        for name, pipeline in (('scalar', _scalar_pipeline),
+                               ('batch', _batch_pipeline)):
+            seconds = _best_time(lambda: pipeline(size),
+                                 1 if size >= 1_000_000 else repeat)
+            result[f'throughput.{name}.{size}'] = size / seconds
+    return result
+
+
+def _read_json(path: str) -> int:
+    count = 0
+    with open(path, encoding='utf-8') as file:
+        for chunk in _chunks(iter(file), 100_000):
+            packages = [homework.parse_json_record(line) for line in chunk]
+            count += len(homework.packages_to_columns(packages)[0])
+    return count
+
+
+def _read_packed(path: str) -> int:
+    count = 0
+    with homework.PackedFile(path) as packed:
+        for _, columns in packed.sections():
+            count += len(columns['action'])
+    return count
+
+
+def _compute_json(path: str) -> int:
+    count = 0
+    with open(path, encoding='utf-8') as file:
+        for chunk in _chunks(iter(file), 100_000):
+            packages = [homework.parse_json_record(line) for line in chunk]
+            result = homework.compute_batch(
+                *homework.packages_to_columns(packages))
+            count += len(result['calories'])
+    return count
+
+
+def _compute_packed(path: str) -> int:
+    count = 0
+    with homework.PackedFile(path) as packed:
+        for _, result in packed.compute():
+            count += len(result['calories'])
+    return count
+
+
+def read_throughput(size: int = 100_000,
+                    repeat: int = 3) -> Dict[str, float]:
+    """Пакетов в секунду при чтении JSON Lines и двоичного формата.
+
+    read — разбор в колонки, compute — разбор и compute_batch.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'packages.jsonl')
+        packed_path = os.path.join(directory, 'packages.bin')
+        with open(json_path, 'w', encoding='utf-8') as file:
+            for package in synthetic_packages(size):
+                file.write(json.dumps(package) + '\n')
+        homework.convert_to_packed(json_path, packed_path)
+        result = {}
+        for name, read in (('read.jsonl', _read_json),
+                           ('read.packed', _read_packed),
+                           ('compute.jsonl', _compute_json),
+                           ('compute.packed', _compute_packed)):
+            path = packed_path if name.endswith('packed') else json_path
+            result[f'throughput.{name}.{size}'] = size / _best_time(
+                lambda: read(path), repeat)
+        result['bytes.jsonl'] = os.path.getsize(json_path) / size
+        result['bytes.packed'] = os.path.getsize(packed_path) / size
+    return result
+
+
+def _threaded_time(processor: homework.TrainingProcessor,
+                   parts: List[list]) -> float:
+    """Время, за которое потоки обработают свои части пакетов."""
+    barrier = threading.Barrier(len(parts) + 1)
+
+    def work(part: list) -> None:
+        barrier.wait()
+        for workout_type, data in part:
+            processor.process(workout_type, data)
+
+    with ThreadPoolExecutor(len(parts)) as pool:
+        futures = [pool.submit(work, part) for part in parts]
+        barrier.wait()
+        started = time.perf_counter()
+        for future in futures:
+            future.result()
+        return time.perf_counter() - started
+
+
+def contention(threads: Sequence[int] = (1, 2, 4, 8, 16, 32, 64),
+               count: int = 50_000, repeat: int = 3) -> Dict[str, float]:
+    """Пакетов в секунду через один TrainingProcessor на 1–64 потоках.
+
+    cold — кэш выключен, потоки делят только таблицу конструкторов;
+    warm — все пакеты уже в кэше, потоки спорят за замки его частей.
+    На сборке без GIL рост с числом потоков показывает масштабирование.
+    """
+    packages = list(synthetic_packages(count))
+    warm = homework.TrainingProcessor(cache_size=count)
+    for package in packages:
+        warm.process(*package)
+    cold = homework.TrainingProcessor(cache_size=0)
+    result = {}
+    for number in threads:
+        parts = [packages[index::number] for index in range(number)]
+        for name, processor in (('cold', cold), ('warm', warm)):
+            seconds = min(_threaded_time(processor, parts)
+                          for _ in range(repeat))
+            result[f'throughput.contention.{name}.{number}'] = (
+                count / seconds)
+    return result
+
+
+def gil_enabled() -> bool:
+    """Включён ли GIL (False только на free-threaded сборке CPython)."""
+    return getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def run_suite(sizes: Sequence[int], repeat: int) -> Dict[str, object]:
+    """Собрать все замеры в словарь для сохранения в JSON."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'gil': gil_enabled(),
+        'kernels': homework.kernel_backend(),
+        'units': {'throughput': 'packages/s', 'default': 'ns/op'},
+        'results': {**hot_paths(repeat=repeat),
+                    **throughput(sizes, repeat),
+                    **read_throughput(max(sizes), repeat)},
+    }
+
+
+def compare(baseline: Dict[str, float], current: Dict[str, float],
+            threshold: float = 0.1) -> List[Tuple[str, float]]:
+    """Найти замедления больше threshold (0.1 — на 10 %).
+
+    Для throughput.* больше — лучше, для остальных замеров — меньше.
+    Возвращает пары (имя замера, относительное замедление).
+    """
+    slowdowns = []
+    for name in sorted(baseline.keys() & current.keys()):
+        old, new = baseline[name], current[name]
+        if name.startswith('throughput.'):
+            old, new = new, old
+        if old > 0 and new / old - 1 > threshold:
+            slowdowns.append((name, new / old - 1))
+    return slowdowns
+
+
+def _print_table(rows: Dict[str, Dict[str, float]]) -> None:
+    columns: List[str] = []
+    for values in rows.values():
+        columns.extend(name for name in values if name not in columns)
+    print(f'{"":15}' + ''.join(f'{name:>12}' for name in columns))
+    for title, values in rows.items():
+        cells = ''.join(f'{values[name]:>12.1f}' if name in values
+                        else f'{"-":>12}' for name in columns)
+        print(f'{title:15}{cells}')
+
+
+def _run(args: argparse.Namespace) -> int:
+    report = run_suite(args.sizes, args.repeat)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    reports = []
+    for path in (args.baseline, args.current):
+        with open(path, encoding='utf-8') as file:
+            reports.append(json.load(file)['results'])
+    slowdowns = compare(*reports, threshold=args.threshold)
+    for name, slowdown in slowdowns:
+        print(f'{name}: медленнее на {slowdown:.1%}')
+    return 1 if slowdowns else 0
+
+
+def _packed(args: argparse.Namespace) -> int:
+    for name, value in read_throughput(args.size).items():
+        print(f'{name:40}{value:>16,.1f}')
+    return 0
+
+
+def _contention(args: argparse.Namespace) -> int:
+    print(f'GIL включён: {"да" if gil_enabled() else "нет"}')
+    for name, value in contention(args.threads, args.count).items():
+        print(f'{name:40}{value:>16,.1f}')
+    return 0
+
+
+def _memory(args: argparse.Namespace) -> int:
+    print('Байт на запись:')
+    _print_table(memory_per_record())
+    return 0
+
+
+def _dispatch(args: argparse.Namespace) -> int:
+    print('Выбор вида тренировки, нс на пакет:')
+    _print_table(dispatch_cost())
+    return 0
+
+
+COMMANDS: Dict[str, Callable[[argparse.Namespace], int]] = {
+    'run': _run,
+    'compare': _compare,
+    'packed': _packed,
+    'contention': _contention,
+    'memory': _memory,
+    'dispatch': _dispatch,
+}
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='прогнать набор замеров')
+    run.add_argument('--sizes', type=int, nargs='+',
+                     default=[1_000, 10_000, 100_000],
+                     help='размеры синтетических наборов, до 10**7')
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--output', help='файл JSON для результатов')
+    check = commands.add_parser('compare', help='сравнить два прогона')
+    check.add_argument('baseline')
+    check.add_argument('current')
+    check.add_argument('--threshold', type=float, default=0.1)
+    commands.add_parser('memory', help='байт на запись')
+    commands.add_parser('dispatch', help='стоимость выбора тренировки')
+    packed = commands.add_parser('packed',
+                                 help='чтение JSON Lines и двоичного формата')
+    packed.add_argument('--size', type=int, default=100_000)
+    threads = commands.add_parser(
+        'contention', help='общий TrainingProcessor на нескольких потоках')
+    threads.add_argument('--threads', type=int, nargs='+',
+                         default=[1, 2, 4, 8, 16, 32, 64])
+    threads.add_argument('--count', type=int, default=50_000)
+    args = parser.parse_args(argv)
+    return COMMANDS[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,250 @@
-from dataclasses import dataclass, asdict
-from typing import ClassVar, Sequence, Union
+"""Модуль фитнес-трекера.
+
+Импорт модуля должен оставаться дешёвым: его вызывают короткоживущие
+задачи. Тяжёлые модули (asyncio, json, sqlite3, multiprocessing и т. п.)
+импортируются внутри функций, которые ими пользуются, а аннотации
+не вычисляются при импорте. Бюджет проверяется в tests/test_homework.py.
+"""
+from __future__ import annotations
+
+import os
+import struct
+import sys
+import time
+from bisect import bisect_left
+from itertools import islice
+from operator import attrgetter
+from time import perf_counter
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import argparse
+    import asyncio
+    import cProfile
+    import multiprocessing.pool
+    import pstats
+    import sqlite3
+    import subprocess
+    import threading
+    from array import array
+    from collections import deque
+    from multiprocessing.connection import Connection, Listener
+    from concurrent.futures import Executor
+    from http.server import ThreadingHTTPServer
+    from queue import SimpleQueue
+    from typing import (IO, Any, Callable, ClassVar, Dict, Hashable,
+                        Iterable, Iterator, List, Mapping, Optional,
+                        Sequence, Tuple, Union)
+
+
+def compile_template(template: str) -> Tuple[str, Tuple[str, ...]]:
+    """Перевести шаблон str.format в %-шаблон и порядок полей.
+
+    Поддерживаются поля {name} и {name:spec} без преобразований (!r, !s)
+    и вложенных полей; spec должен быть понятен оператору % (например, .3f).
+    """
+    parts = []
+    names = []
+    position = 0
+    while position < len(template):
+        char = template[position]
+        if char in '{}' and template[position + 1:position + 2] == char:
+            parts.append(char)
+            position += 2
+            continue
+        if char == '}':
+            raise ValueError('Одиночная "}" в шаблоне')
+        if char != '{':
+            parts.append('%%' if char == '%' else char)
+            position += 1
+            continue
+        end = template.find('}', position)
+        if end < 0:
+            raise ValueError('Одиночная "{" в шаблоне')
+        name, _, spec = template[position + 1:end].partition(':')
+        if not name.isidentifier() or '{' in spec:
+            raise ValueError(f'Поле {name!r} нельзя скомпилировать')
+        parts.append(f'%{spec}' if spec else '%s')
+        names.append(name)
+        position = end + 1
+    return ''.join(parts), tuple(names)
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными границами корзин."""
+    __slots__ = ('counts', 'total')
+
+    def __init__(self, size: int) -> None:
+        self.counts = [0] * size
+        self.total = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+class Metrics:
+    """Счётчики и гистограммы длительностей по операциям и кодам.
+
+    Сбор включается enable_metrics(); пока он выключен, горячие пути
+    только проверяют, что глобальная METRICS равна None.
+    """
+    BUCKETS: Tuple[float, ...] = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5,
+                                  1e-4, 2.5e-4, 1e-3, 1e-2)
+    PREFIX = 'homework'
+
+    def __init__(self, buckets: Optional[Sequence[float]] = None) -> None:
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, operation: str, workout_type: str,
+                seconds: float) -> None:
+        """Учесть один вызов operation длительностью seconds."""
+        key = (operation, workout_type)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(
+                len(self.buckets) + 1)
+        histogram.counts[bisect_left(self.buckets, seconds)] += 1
+        histogram.total += seconds
+
+    def merge(self, other: 'Metrics') -> 'Metrics':
+        """Прибавить к себе гистограммы other с теми же корзинами."""
+        if other.buckets != self.buckets:
+            raise ValueError('Границы корзин метрик не совпадают')
+        for key, source in list(other.histograms.items()):
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(
+                    len(self.buckets) + 1)
+            for index, count in enumerate(source.counts):
+                histogram.counts[index] += count
+            histogram.total += source.total
+        return self
+
+    def count(self, operation: str, workout_type: str) -> int:
+        """Число учтённых вызовов operation для кода workout_type."""
+        histogram = self.histograms.get((operation, workout_type))
+        return histogram.count if histogram else 0
+
+    def to_prometheus(self) -> str:
+        """Выгрузить метрики в текстовом формате Prometheus."""
+        name = f'{self.PREFIX}_operation_seconds'
+        total_name = f'{self.PREFIX}_operations_total'
+        lines = [
+            f'# HELP {total_name} Число вызовов операции.',
+            f'# TYPE {total_name} counter',
+        ]
+        items = sorted(self.histograms.items())
+        for (operation, workout_type), histogram in items:
+            labels = (f'operation="{operation}",'
+                      f'workout_type="{workout_type}"')
+            lines.append(f'{total_name}{{{labels}}} {histogram.count}')
+        lines += [f'# HELP {name} Длительность операции в секундах.',
+                  f'# TYPE {name} histogram']
+        for (operation, workout_type), histogram in items:
+            labels = (f'operation="{operation}",'
+                      f'workout_type="{workout_type}"')
+            cumulative = 0
+            bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.total!r}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """Атомарно записать метрики в файл (для textfile collector)."""
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+        os.replace(temporary, path)
+
+
+METRICS: Optional[Metrics] = None
+
+
+def enable_metrics(metrics: Optional[Metrics] = None) -> Metrics:
+    """Включить сбор метрик и вернуть используемый объект Metrics."""
+    global METRICS
+    METRICS = metrics if metrics is not None else Metrics()
+    return METRICS
+
+
+def disable_metrics() -> Optional[Metrics]:
+    """Выключить сбор метрик и вернуть собранные данные."""
+    global METRICS
+    metrics, METRICS = METRICS, None
+    return metrics
+
+
+def serve_metrics(host: str = '127.0.0.1',
+                  port: int = 0) -> ThreadingHTTPServer:
+    """Отдавать METRICS по HTTP в фоновом потоке; вернуть сервер.
+
+    Остановить сервер: server.shutdown().
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            metrics = METRICS
+            body = (metrics.to_prometheus() if metrics else '').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_PROFILER: Optional[cProfile.Profile] = None
+
+
+def start_profiling() -> None:
+    """Включить cProfile для всего процесса."""
+    global _PROFILER
+    import cProfile
+    _PROFILER = cProfile.Profile()
+    _PROFILER.enable()
+
+
+def dump_profile(path: Optional[str] = None) -> pstats.Stats:
+    """Снять снимок профиля, не останавливая профилирование.
+
+    Если передан path, снимок сохраняется в формате pstats.
+    """
+    import pstats
+    if _PROFILER is None:
+        raise RuntimeError('Профилирование не запущено')
+    _PROFILER.disable()
+    try:
+        stats = pstats.Stats(_PROFILER)
+        if path is not None:
+            stats.dump_stats(path)
+    finally:
+        _PROFILER.enable()
+    return stats
+
+
+def stop_profiling() -> pstats.Stats:
+    """Остановить профилирование и вернуть итоговую статистику."""
+    global _PROFILER
+    stats = dump_profile()
+    _PROFILER.disable()
+    _PROFILER = None
+    return stats
 
 
-@dataclass
 class InfoMessage:
     """Информационное сообщение о тренировке."""
     MESSAGE: ClassVar[str] = ('Тип тренировки: {training_type}; '
@@ -10,35 +252,294 @@ class InfoMessage:
                               'Дистанция: {distance:.3f} км; '
                               'Ср. скорость: {speed:.3f} км/ч; '
                               'Потрачено ккал: {calories:.3f}.')
+    __slots__ = ('training_type', 'duration', 'distance', 'speed',
+                 'calories')
     training_type: str
     duration: float
     distance: float
     speed: float
     calories: float
+    __hash__ = None
+
+    def __init__(self, training_type: str, duration: float, distance: float,
+                 speed: float, calories: float) -> None:
+        self.training_type = training_type
+        self.duration = duration
+        self.distance = distance
+        self.speed = speed
+        self.calories = calories
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}(training_type={self.training_type!r}'
+                f', duration={self.duration!r}, distance={self.distance!r}'
+                f', speed={self.speed!r}, calories={self.calories!r})')
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return ((self.training_type, self.duration, self.distance,
+                 self.speed, self.calories)
+                == (other.training_type, other.duration, other.distance,
+                    other.speed, other.calories))
 
     def get_message(self) -> str:
-        return self.MESSAGE.format(**asdict(self))
+        metrics = METRICS
+        started = perf_counter() if metrics is not None else 0.0
+        message = self.MESSAGE.format(
+            training_type=self.training_type, duration=self.duration,
+            distance=self.distance, speed=self.speed, calories=self.calories)
+        if metrics is not None:
+            metrics.observe('get_message',
+                            WORKOUT_CODES.get(self.training_type, ''),
+                            perf_counter() - started)
+        return message
+
+
+MESSAGE_TEMPLATE, MESSAGE_FIELDS = compile_template(InfoMessage.MESSAGE)
+_message_fields = attrgetter(*MESSAGE_FIELDS)
+
+
+def format_messages(messages: Iterable[InfoMessage]) -> Iterator[str]:
+    """Лениво отформатировать сообщения по скомпилированному шаблону.
+
+    Результат совпадает с InfoMessage.get_message() побайтно.
+    """
+    template = MESSAGE_TEMPLATE
+    fields = _message_fields
+    for message in messages:
+        yield template % fields(message)
+
+
+def _write_lines(lines: Iterator[str], stream: IO[str],
+                 chunk_size: int) -> int:
+    count = 0
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return count
+        count += len(chunk)
+        chunk.append('')
+        stream.write('\n'.join(chunk))
+
+
+def write_messages(messages: Iterable[InfoMessage], stream: IO[str],
+                   chunk_size: int = 1000) -> int:
+    """Записать сообщения в поток по строке на сообщение.
+
+    Строки собираются порциями по chunk_size и пишутся одним вызовом
+    write на порцию. Возвращает число записанных сообщений.
+    """
+    return _write_lines(format_messages(messages), stream, chunk_size)
+
+
+def write_columns(columns: Mapping[str, Sequence], stream: IO[str],
+                  chunk_size: int = 1000) -> int:
+    """Записать сообщения прямо из колонок compute_batch.
+
+    Объекты InfoMessage не создаются; вывод совпадает с write_messages.
+    """
+    template = MESSAGE_TEMPLATE
+    lines = (template % row
+             for row in zip(*(columns[name] for name in MESSAGE_FIELDS)))
+    return _write_lines(lines, stream, chunk_size)
+
+
+def cached_metric(method: Callable[..., float]) -> Callable[..., float]:
+    """Запомнить результат метода расчёта до изменения параметров.
+
+    Значение хранится в словаре _metrics экземпляра под полным именем
+    метода, поэтому переопределённые методы и вызовы super() не мешают
+    друг другу.
+    """
+    key = method.__qualname__
+
+    def wrapper(self) -> float:
+        metrics = self._metrics
+        if metrics is None:
+            metrics = self._metrics = {}
+        elif key in metrics:
+            return metrics[key]
+        value = metrics[key] = method(self)
+        return value
+    wrapper.__name__ = method.__name__
+    wrapper.__qualname__ = key
+    wrapper.__doc__ = method.__doc__
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def _slotted_init(self, *data: Union[int, float]) -> None:
+    if len(data) != len(self.FIELDS):
+        raise TypeError(f'{type(self).__name__} принимает '
+                        f'{len(self.FIELDS)} параметров, '
+                        f'получено {len(data)}')
+    set_attribute = object.__setattr__
+    set_attribute(self, '_metrics', None)
+    set_attribute(self, '_frozen', False)
+    for name, value in zip(self.FIELDS, data):
+        set_attribute(self, name, value)
+
+
+def make_slotted(training_class: type) -> type:
+    """Создать вариант класса тренировки с __slots__ вместо __dict__.
+
+    Методы и константы копируются из всей иерархии класса, имя класса
+    сохраняется, поэтому сообщения совпадают с исходным классом.
+    Экземпляры не являются подклассом Training и не допускают
+    подмену атрибутов и методов на уровне экземпляра.
+    """
+    namespace = {}
+    for klass in reversed(training_class.__mro__[:-1]):
+        namespace.update(vars(klass))
+    for name in ('__dict__', '__weakref__', '_metrics', '_frozen'):
+        namespace.pop(name, None)
+    namespace['__slots__'] = training_class.FIELDS + ('_metrics', '_frozen')
+    namespace['__init__'] = _slotted_init
+    return type(training_class.__name__, (), namespace)
+
+
+# Флаги объекта кода из inspect, без импорта самого модуля.
+CO_VARARGS = 0x04
+CO_VARKEYWORDS = 0x08
+
+WORKOUT_TYPES: Dict[str, type] = {}
+WORKOUT_CODES: Dict[str, str] = {}
+SLOTTED_TYPES: Dict[str, type] = {}
+WORKOUT_CONSTRUCTORS: Dict[str, Callable[[Sequence], 'Training']] = {}
+PACKAGE_FIELDS: Tuple[str, ...] = ()
+
+
+def _init_fields(training_class: type) -> Tuple[str, ...]:
+    """Имена параметров __init__ без self, прочитанные из объекта кода."""
+    code = training_class.__init__.__code__
+    if code.co_flags & (CO_VARARGS | CO_VARKEYWORDS):
+        return training_class.FIELDS
+    return code.co_varnames[1:code.co_argcount]
+
+
+def _make_constructor(training_class: type,
+                      arity: int) -> Callable[[Sequence], 'Training']:
+    """Собрать конструктор с заранее вычисленной проверкой арности."""
+    name = training_class.__name__
+
+    def construct(data: Iterable[Union[int, float]]) -> 'Training':
+        try:
+            size = len(data)
+        except TypeError:
+            # Итераторы и генераторы, как и в cls(*data), тоже допустимы.
+            data = tuple(data)
+            size = len(data)
+        if size != arity:
+            raise TypeError(f'{name} принимает {arity} параметров, '
+                            f'получено {size}')
+        return training_class(*data)
+    return construct
+
+
+def register_workout(code: str) -> Callable[[type], type]:
+    """Декоратор: зарегистрировать вид тренировки под кодом пакета.
+
+    Поля тренировки (FIELDS) берутся из параметров __init__.
+    Пример для внешнего пакета::
+
+        @register_workout('CYC')
+        class Cycling(Training):
+            ...
+    """
+    def decorator(training_class: type) -> type:
+        global PACKAGE_FIELDS
+        if code in WORKOUT_TYPES:
+            raise ValueError(f'Код тренировки {code} уже занят '
+                             f'классом {WORKOUT_TYPES[code].__name__}')
+        fields = _init_fields(training_class)
+        training_class.FIELDS = fields
+        training_class.CODE = code
+        WORKOUT_TYPES[code] = training_class
+        WORKOUT_CODES[training_class.__name__] = code
+        SLOTTED_TYPES[code] = make_slotted(training_class)
+        WORKOUT_CONSTRUCTORS[code] = _make_constructor(
+            training_class, len(fields))
+        PACKAGE_FIELDS += tuple(name for name in fields
+                                if name not in PACKAGE_FIELDS)
+        return training_class
+    return decorator
+
+
+def unregister_workout(code: str) -> type:
+    """Удалить вид тренировки из реестра и вернуть его класс."""
+    if code not in WORKOUT_TYPES:
+        raise NameError('Такой тренировки нет!')
+    del SLOTTED_TYPES[code], WORKOUT_CONSTRUCTORS[code]
+    training_class = WORKOUT_TYPES.pop(code)
+    WORKOUT_CODES.pop(training_class.__name__, None)
+    return training_class
 
 
 class Training:
-    """Базовый класс тренировки."""
+    """Базовый класс тренировки.
+
+    Дистанция, скорость и калории запоминаются при первом расчёте
+    и сбрасываются при изменении любого публичного атрибута.
+    После freeze() параметры изменить нельзя.
+    """
     LEN_STEP: float = 0.65
     M_IN_KM: int = 1000
     MIN_IN_HOUR: int = 60
+    FIELDS: Tuple[str, ...] = ('action', 'duration', 'weight')
+    # Поля-делители: validate_batch требует, чтобы они были больше нуля.
+    POSITIVE_FIELDS: Tuple[str, ...] = ('duration',)
+    # Верхние границы полей для validate_batch: с ними формулы не
+    # переполняются. Для полей без границы действует MAX_FIELD_VALUE.
+    FIELD_LIMITS: Dict[str, float] = {'action': 1e8, 'duration': 1e4,
+                                      'weight': 1e3}
+    SAMPLE_FIELDS: Tuple[str, ...] = ('action',)
+    CODE: str = ''
+    _metrics: Optional[Dict[str, float]] = None
+    _frozen: bool = False
 
     def __init__(self, action: int, duration: float, weight: float) -> None:
         self.action = action
         self.duration = duration
         self.weight = weight
 
+    def _invalidate(self, name: str) -> None:
+        """Сбросить кэш показателей перед изменением атрибута name."""
+        if name.startswith('_'):
+            return
+        if self._frozen:
+            raise AttributeError(
+                f'Тренировка {type(self).__name__} заморожена')
+        self._metrics.clear()
+
+    def __setattr__(self, name: str, value) -> None:
+        if self._metrics or self._frozen:
+            self._invalidate(name)
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name: str) -> None:
+        if self._metrics or self._frozen:
+            self._invalidate(name)
+        object.__delattr__(self, name)
+
+    def freeze(self) -> 'Training':
+        """Заморозить параметры и сразу рассчитать все показатели."""
+        self.get_spent_calories()
+        self.get_distance()
+        self.get_mean_speed()
+        self._frozen = True
+        return self
+
+    @cached_metric
     def get_distance(self) -> float:
         """Получить дистанцию в км."""
         return (self.action * self.LEN_STEP) / self.M_IN_KM
 
+    @cached_metric
     def get_mean_speed(self) -> float:
         """Получить среднюю скорость движения."""
         return self.get_distance() / self.duration
 
+    @cached_metric
     def get_spent_calories(self) -> float:
         """Получить количество затраченных калорий."""
         raise NotImplementedError(f'В классе {self.__class__.__name__}',
@@ -46,30 +547,75 @@ class Training:
 
     def show_training_info(self) -> InfoMessage:
         """Вернуть информационное сообщение о выполненной тренировке."""
+        metrics = METRICS
+        started = perf_counter() if metrics is not None else 0.0
+        info = self._info()
+        if metrics is not None:
+            metrics.observe('show_training_info', self.CODE,
+                            perf_counter() - started)
+        return info
+
+    def _info(self) -> InfoMessage:
+        """InfoMessage без записи в METRICS."""
         return InfoMessage(self.__class__.__name__, self.duration,
                            self.get_distance(), self.get_mean_speed(),
                            self.get_spent_calories())
 
+    @classmethod
+    def _batch_distance(cls, columns: Mapping[str, Sequence]) -> List[float]:
+        """Дистанция для колонок пакетов, формула как в get_distance."""
+        return [(action * cls.LEN_STEP) / cls.M_IN_KM
+                for action in columns['action']]
+
+    @classmethod
+    def _batch_mean_speed(cls, columns: Mapping[str, Sequence],
+                          distance: List[float]) -> List[float]:
+        """Средняя скорость для колонок, формула как в get_mean_speed."""
+        return [dist / duration
+                for dist, duration in zip(distance, columns['duration'])]
+
+    @classmethod
+    def _batch_spent_calories(cls, columns: Mapping[str, Sequence],
+                              speed: List[float]) -> List[float]:
+        """Калории для колонок, формула как в get_spent_calories."""
+        raise NotImplementedError(f'В классе {cls.__name__}',
+                                  'этот метод не определен')
+
 
+@register_workout('RUN')
 class Running(Training):
     """Тренировка: бег."""
     COEFF_CALORIES_1: int = 18
     COEFF_CALORIES_2: int = 20
 
+    @cached_metric
     def get_spent_calories(self) -> float:
         """Получаем количетво затраченных калорий."""
         return((self.COEFF_CALORIES_1 * self.get_mean_speed()
                - self.COEFF_CALORIES_2) * self.weight / self.M_IN_KM
                * (self.MIN_IN_HOUR * self.duration))
 
+    @classmethod
+    def _batch_spent_calories(cls, columns: Mapping[str, Sequence],
+                              speed: List[float]) -> List[float]:
+        return [(cls.COEFF_CALORIES_1 * spd - cls.COEFF_CALORIES_2)
+                * weight / cls.M_IN_KM * (cls.MIN_IN_HOUR * duration)
+                for spd, weight, duration
+                in zip(speed, columns['weight'], columns['duration'])]
+
 
+@register_workout('WLK')
 class SportsWalking(Training):
     """Тренировка: спортивная ходьба."""
 
     COEFF_1: float = 0.035
     COEFF_2: int = 2
     COEFF_3: float = 0.029
+    POSITIVE_FIELDS: Tuple[str, ...] = ('duration', 'height')
+    FIELD_LIMITS: Dict[str, float] = {**Training.FIELD_LIMITS,
+                                      'height': 1e3}
 
+    @cached_metric
     def get_spent_calories(self) -> float:
         """Получаем количетво затраченных калорий."""
         return(((self.COEFF_1 * self.weight) + (self.get_mean_speed()
@@ -82,12 +628,25 @@ class SportsWalking(Training):
         super().__init__(action, duration, weight)
         self.height = height
 
+    @classmethod
+    def _batch_spent_calories(cls, columns: Mapping[str, Sequence],
+                              speed: List[float]) -> List[float]:
+        return [((cls.COEFF_1 * weight) + (spd ** cls.COEFF_2 // height)
+                 * (cls.COEFF_3 * weight)) * cls.MIN_IN_HOUR * duration
+                for spd, weight, height, duration
+                in zip(speed, columns['weight'], columns['height'],
+                       columns['duration'])]
 
+
+@register_workout('SWM')
 class Swimming(Training):
     """Тренировка: плавание."""
     LEN_STEP: float = 1.38
     COEFF_1: float = 1.1
     COEFF_2: int = 2
+    SAMPLE_FIELDS: Tuple[str, ...] = ('action', 'count_pool')
+    FIELD_LIMITS: Dict[str, float] = {**Training.FIELD_LIMITS,
+                                      'length_pool': 1e4, 'count_pool': 1e6}
 
     def __init__(self, action: int, duration: float, weight: float,
                  length_pool: float, count_pool: int) -> None:
@@ -95,33 +654,2088 @@ class Swimming(Training):
         self.length_pool = length_pool
         self.count_pool = count_pool
 
+    @cached_metric
     def get_mean_speed(self) -> float:
         """Получаем средную скорость плавания."""
         return(self.length_pool * self.count_pool
                / self.M_IN_KM / self.duration)
 
+    @cached_metric
     def get_spent_calories(self) -> float:
         """Получаем количетво затраченных калорий."""
         return((self.get_mean_speed() + self.COEFF_1)
                * self.COEFF_2 * self.weight)
 
+    @cached_metric
     def get_distance(self) -> float:
         """Получаем дистанцию"""
         return self.action * self.LEN_STEP / self.M_IN_KM
 
+    @classmethod
+    def _batch_distance(cls, columns: Mapping[str, Sequence]) -> List[float]:
+        return [action * cls.LEN_STEP / cls.M_IN_KM
+                for action in columns['action']]
+
+    @classmethod
+    def _batch_mean_speed(cls, columns: Mapping[str, Sequence],
+                          distance: List[float]) -> List[float]:
+        return [length_pool * count_pool / cls.M_IN_KM / duration
+                for length_pool, count_pool, duration
+                in zip(columns['length_pool'], columns['count_pool'],
+                       columns['duration'])]
+
+    @classmethod
+    def _batch_spent_calories(cls, columns: Mapping[str, Sequence],
+                              speed: List[float]) -> List[float]:
+        return [(spd + cls.COEFF_1) * cls.COEFF_2 * weight
+                for spd, weight in zip(speed, columns['weight'])]
+
+
+BATCH_COLUMNS: Tuple[str, ...] = ('training_type', 'duration', 'distance',
+                                  'speed', 'calories')
+
+
+def read_package(workout_type: str, data: Sequence[Union[int, float]],
+                 frozen: bool = False) -> Training:
+    """Прочитать данные полученные от датчиков.
 
-def read_package(workout_type: str,
-                 data: Sequence[Union[int, float]]) -> Training:
-    """Прочитать данные полученные от датчиков."""
-    workout_type_dict = {
-        'SWM': Swimming,
-        'WLK': SportsWalking,
-        'RUN': Running
-    }
+    С frozen=True тренировка сразу замораживается (см. Training.freeze).
+    """
+    metrics = METRICS
+    started = perf_counter() if metrics is not None else 0.0
     try:
-        return workout_type_dict.get(workout_type)(*data)
+        construct = WORKOUT_CONSTRUCTORS[workout_type]
     except KeyError:
         raise NameError('Такой тренировки нет!')
+    training = construct(data)
+    if frozen:
+        training.freeze()
+    if metrics is not None:
+        metrics.observe('read_package', workout_type,
+                        perf_counter() - started)
+    return training
+
+
+BATCH_METHODS = (
+    ('get_distance', '_batch_distance'),
+    ('get_mean_speed', '_batch_mean_speed'),
+    ('get_spent_calories', '_batch_spent_calories'),
+)
+
+
+def _has_batch_formulas(training_class: type) -> bool:
+    """Проверить, что пакетные формулы не отстают от методов класса.
+
+    Если класс (например, подключённый через register_workout)
+    переопределил get_* без парного _batch_*, пакетная формула
+    родителя дала бы другой результат.
+    """
+    mro = training_class.__mro__
+
+    def owner(name: str) -> int:
+        return next(index for index, klass in enumerate(mro)
+                    if name in vars(klass))
+    return all(owner(batch) <= owner(scalar)
+               for scalar, batch in BATCH_METHODS)
+
+
+def _running_calories(speed: float, weight: float, duration: float,
+                      coeff_1: float, coeff_2: float, m_in_km: float,
+                      min_in_hour: float) -> float:
+    return ((coeff_1 * speed - coeff_2) * weight / m_in_km
+            * (min_in_hour * duration))
+
+
+def _walking_calories(speed: float, weight: float, height: float,
+                      duration: float, coeff_1: float, coeff_2: float,
+                      coeff_3: float, min_in_hour: float) -> float:
+    return (((coeff_1 * weight) + (speed ** coeff_2 // height)
+             * (coeff_3 * weight)) * min_in_hour * duration)
+
+
+def _swimming_calories(speed: float, weight: float, coeff_1: float,
+                       coeff_2: float) -> float:
+    return (speed + coeff_1) * coeff_2 * weight
+
+
+# Формулы калорий для ускоренных реализаций: класс, в котором определена
+# _batch_spent_calories -> (формула, колонки, атрибуты-коэффициенты).
+# Формулы повторяют порядок операций get_spent_calories и работают как
+# с числами, так и с массивами NumPy.
+CALORIE_KERNELS: Dict[type, Tuple[Callable, Tuple[str, ...],
+                                  Tuple[str, ...]]] = {
+    Running: (_running_calories, ('weight', 'duration'),
+              ('COEFF_CALORIES_1', 'COEFF_CALORIES_2', 'M_IN_KM',
+               'MIN_IN_HOUR')),
+    SportsWalking: (_walking_calories, ('weight', 'height', 'duration'),
+                    ('COEFF_1', 'COEFF_2', 'COEFF_3', 'MIN_IN_HOUR')),
+    Swimming: (_swimming_calories, ('weight',), ('COEFF_1', 'COEFF_2')),
+}
+KERNEL_BACKENDS = ('numba', 'numpy', 'python')
+# Меньшие группы быстрее считаются списками, чем с переводом в массивы.
+KERNEL_MIN_ROWS = 1024
+_KERNEL_BACKEND: Optional[str] = None
+_KERNELS: Dict[type, Callable] = {}
+
+
+def _array_kernel(numpy: Any, formula: Callable, columns: Tuple[str, ...],
+                  coefficients: Tuple[str, ...]) -> Callable:
+    """Обернуть формулу: колонки группы -> массивы -> список калорий."""
+    def kernel(training_class: type, group: Mapping[str, Sequence],
+               speed: Sequence[float]) -> List[float]:
+        arrays = [numpy.asarray(group[name], dtype=numpy.float64)
+                  for name in columns]
+        values = formula(numpy.asarray(speed, dtype=numpy.float64), *arrays,
+                         *(getattr(training_class, name)
+                           for name in coefficients))
+        return values.tolist()
+    return kernel
+
+
+def _load_kernels(backend: str) -> Dict[type, Callable]:
+    """Собрать ядра backend; ImportError, если зависимости нет."""
+    if backend == 'python':
+        return {}
+    import numpy
+    kernels = {}
+    for owner, (formula, columns, coefficients) in CALORIE_KERNELS.items():
+        if backend == 'numba':
+            import numba
+            arity = 1 + len(columns) + len(coefficients)
+            formula = numba.vectorize(
+                [f'float64({", ".join(["float64"] * arity)})'])(formula)
+        kernels[owner] = _array_kernel(numpy, formula, columns, coefficients)
+    return kernels
+
+
+def set_kernel_backend(backend: Optional[str] = None) -> str:
+    """Выбрать реализацию формул калорий для compute_batch.
+
+    None — первая доступная из KERNEL_BACKENDS: Numba (ufunc,
+    скомпилированный numba.vectorize), NumPy (выражение над массивами)
+    или чистый Python (_batch_spent_calories, эталон). Зависимости
+    импортируются только здесь. Возвращает имя выбранной реализации.
+    """
+    global _KERNEL_BACKEND, _KERNELS
+    if backend is not None and backend not in KERNEL_BACKENDS:
+        raise ValueError(f'Неизвестная реализация формул: {backend}')
+    if backend is not None:
+        _KERNELS = _load_kernels(backend)
+    else:
+        for backend in KERNEL_BACKENDS:
+            try:
+                _KERNELS = _load_kernels(backend)
+            except ImportError:
+                continue
+            break
+    _KERNEL_BACKEND = backend
+    return backend
+
+
+def kernel_backend() -> str:
+    """Имя используемой реализации формул (выбирается при первом вызове)."""
+    return _KERNEL_BACKEND or set_kernel_backend()
+
+
+def _batch_spent_calories(training_class: type,
+                          group: Mapping[str, Sequence],
+                          speed: List[float]) -> List[float]:
+    if len(speed) >= KERNEL_MIN_ROWS:
+        kernel_backend()
+        owner = next(klass for klass in training_class.__mro__
+                     if '_batch_spent_calories' in vars(klass))
+        kernel = _KERNELS.get(owner)
+        if kernel is not None:
+            return kernel(training_class, group, speed)
+    return training_class._batch_spent_calories(group, speed)
+
+
+def _batch_metrics(training_class: type, group: Mapping[str, Sequence]
+                   ) -> Tuple[List[float], List[float], List[float]]:
+    if _has_batch_formulas(training_class):
+        distance = training_class._batch_distance(group)
+        speed = training_class._batch_mean_speed(group, distance)
+        calories = _batch_spent_calories(training_class, group, speed)
+        return distance, speed, calories
+    trainings = [training_class(*row)
+                 for row in zip(*(group[name]
+                                  for name in training_class.FIELDS))]
+    return ([training.get_distance() for training in trainings],
+            [training.get_mean_speed() for training in trainings],
+            [training.get_spent_calories() for training in trainings])
+
+
+def compute_batch(workout_types: Sequence[str],
+                  columns: Mapping[str, Sequence[Union[int, float]]]
+                  ) -> Dict[str, list]:
+    """Рассчитать результаты для пачки пакетов за один проход по типу.
+
+    workout_types — коды тренировок, columns — колонки параметров
+    (action, duration, weight, height, length_pool, count_pool) той же
+    длины. Поля, которых нет у вида тренировки, в его строках игнорируются.
+    Возвращает колонки BATCH_COLUMNS в порядке входных пакетов.
+    """
+    groups: Dict[str, List[int]] = {}
+    for index, code in enumerate(workout_types):
+        groups.setdefault(code, []).append(index)
+    size = len(workout_types)
+    result: Dict[str, list] = {name: [None] * size for name in BATCH_COLUMNS}
+    for code, indexes in groups.items():
+        if code not in WORKOUT_TYPES:
+            raise NameError('Такой тренировки нет!')
+        training_class = WORKOUT_TYPES[code]
+        if len(indexes) == size:
+            group = {name: columns[name] for name in training_class.FIELDS}
+        else:
+            group = {name: [columns[name][i] for i in indexes]
+                     for name in training_class.FIELDS}
+        values = _batch_metrics(training_class, group)
+        for name, column in zip(BATCH_COLUMNS[2:], values):
+            target = result[name]
+            for index, value in zip(indexes, column):
+                target[index] = value
+        training_type = result['training_type']
+        duration = result['duration']
+        for index, value in zip(indexes, group['duration']):
+            training_type[index] = training_class.__name__
+            duration[index] = value
+    return result
+
+
+def packages_to_columns(packages: Iterable[Tuple[str, Sequence]]
+                        ) -> Tuple[List[str], Dict[str, list]]:
+    """Разложить пакеты (код, данные) в колонки для compute_batch.
+
+    Отсутствующие у вида тренировки поля заполняются нулями.
+    """
+    workout_types: List[str] = []
+    columns: Dict[str, list] = {name: [] for name in PACKAGE_FIELDS}
+    for workout_type, data in packages:
+        if workout_type not in WORKOUT_TYPES:
+            raise NameError('Такой тренировки нет!')
+        fields = WORKOUT_TYPES[workout_type].FIELDS
+        if len(data) != len(fields):
+            raise TypeError(f'Для {workout_type} нужно {len(fields)} '
+                            f'параметров, получено {len(data)}')
+        row = dict(zip(fields, data))
+        for name, column in columns.items():
+            column.append(row.get(name, 0))
+        workout_types.append(workout_type)
+    return workout_types, columns
+
+
+class TrainingBatch:
+    """Колоночное хранилище пакетов одного вида тренировки.
+
+    Каждое поле вида хранится в отдельном array('d'), объекты
+    тренировки (из SLOTTED_TYPES) создаются только при обращении к строке.
+    """
+    __slots__ = ('workout_type', 'training_class', 'columns')
+
+    def __init__(self, workout_type: str,
+                 rows: Iterable[Sequence[Union[int, float]]] = ()) -> None:
+        if workout_type not in WORKOUT_TYPES:
+            raise NameError('Такой тренировки нет!')
+        from array import array
+        self.workout_type = workout_type
+        self.training_class = SLOTTED_TYPES[workout_type]
+        self.columns: Dict[str, array] = {
+            name: array('d') for name in self.training_class.FIELDS
+        }
+        self.extend(rows)
+
+    def append(self, data: Sequence[Union[int, float]]) -> None:
+        """Добавить данные одного пакета."""
+        if len(data) != len(self.columns):
+            raise TypeError(f'Для {self.workout_type} нужно '
+                            f'{len(self.columns)} параметров, '
+                            f'получено {len(data)}')
+        for column, value in zip(self.columns.values(), data):
+            column.append(value)
+
+    def extend(self, rows: Iterable[Sequence[Union[int, float]]]) -> None:
+        """Добавить данные нескольких пакетов."""
+        for data in rows:
+            self.append(data)
+
+    def __len__(self) -> int:
+        return len(self.columns['action'])
+
+    def row(self, index: int) -> Tuple[float, ...]:
+        """Вернуть данные пакета по номеру."""
+        return tuple(column[index] for column in self.columns.values())
+
+    def __getitem__(self, index: int):
+        return self.training_class(*self.row(index))
+
+    @property
+    def nbytes(self) -> int:
+        """Размер данных колонок в байтах."""
+        return sum(column.itemsize * len(column)
+                   for column in self.columns.values())
+
+    def compute(self) -> Dict[str, list]:
+        """Рассчитать результаты всей пачки через compute_batch."""
+        return compute_batch([self.workout_type] * len(self), self.columns)
+
+
+def _compute_chunk(chunk: List[Tuple[str, Sequence]]) -> List[tuple]:
+    """Рассчитать порцию пакетов в рабочем процессе."""
+    result = compute_batch(*packages_to_columns(chunk))
+    return list(zip(*(result[name] for name in BATCH_COLUMNS)))
+
+
+def _chunked(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_parallel(packages: Iterable[Tuple[str, Sequence]],
+                     workers: Optional[int] = None, chunk_size: int = 1000,
+                     ordered: bool = True) -> Iterator[InfoMessage]:
+    """Обработать пакеты в пуле процессов.
+
+    Пакеты отправляются рабочим процессам порциями по chunk_size,
+    назад возвращаются кортежи полей, поэтому сериализация идёт один раз
+    на порцию, а не на каждый пакет. В работе не больше двух порций на
+    процесс: вход читается по мере выдачи результатов, а не целиком.
+    При ordered=False результаты порций возвращаются по мере готовности,
+    порядок внутри порции сохраняется. workers=1 считает всё в текущем
+    процессе.
+    """
+    if chunk_size < 1:
+        raise ValueError('Размер порции должен быть положительным')
+    chunks = _chunked(packages, chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            for row in _compute_chunk(chunk):
+                yield InfoMessage(*row)
+        return
+    import multiprocessing
+    window = 2 * (workers or os.cpu_count() or 1)
+    with multiprocessing.Pool(workers) as pool:
+        for rows in _bounded_map(pool, chunks, window, ordered):
+            for row in rows:
+                yield InfoMessage(*row)
+
+
+def _bounded_map(pool: multiprocessing.pool.Pool, chunks: Iterator[list],
+                 window: int, ordered: bool) -> Iterator[List[tuple]]:
+    """Считать порции в пуле, держа в работе не больше window порций.
+
+    В отличие от Pool.imap, поток-отправитель которого вычитывает вход
+    целиком, следующая порция берётся только после выдачи результата.
+    """
+    from collections import deque
+    from queue import SimpleQueue
+    in_flight: deque = deque()
+    done: SimpleQueue = SimpleQueue()
+    for chunk in chunks:
+        if ordered:
+            in_flight.append(pool.apply_async(_compute_chunk, (chunk,)))
+        else:
+            in_flight.append(pool.apply_async(
+                _compute_chunk, (chunk,), callback=done.put,
+                error_callback=done.put))
+        if len(in_flight) >= window:
+            yield _next_rows(in_flight, done, ordered)
+    while in_flight:
+        yield _next_rows(in_flight, done, ordered)
+
+
+def _next_rows(in_flight: deque, done: SimpleQueue,
+               ordered: bool) -> List[tuple]:
+    if ordered:
+        return in_flight.popleft().get()
+    in_flight.pop()
+    rows = done.get()
+    if isinstance(rows, BaseException):
+        raise rows
+    return rows
+
+
+def _sum_samples(values: Sequence[Union[int, float]]) -> Union[int, float]:
+    # У массивов NumPy сумма считается без поэлементного цикла Python.
+    total = values.sum() if hasattr(values, 'sum') else sum(values)
+    return total.item() if hasattr(total, 'item') else total
+
+
+class SampleAccumulator:
+    """Потоковый расчёт тренировки по сырым отсчётам датчиков.
+
+    Отсчёты поступают порциями через feed(): по одному значению на каждый
+    интервал sample_interval секунд для каждого поля SAMPLE_FIELDS вида
+    тренировки (шаги или гребки, для плавания ещё проплытые бассейны).
+    Остальные параметры (вес, рост, длина бассейна) постоянны и задаются
+    при создании. Хранятся только суммы, поэтому память не зависит
+    от длины потока. С lap_samples за тот же проход считаются круги
+    по lap_samples отсчётов.
+    """
+    SECONDS_IN_HOUR = 3600
+
+    def __init__(self, workout_type: str, sample_interval: float = 1.0,
+                 lap_samples: Optional[int] = None,
+                 **params: Union[int, float]) -> None:
+        if workout_type not in WORKOUT_TYPES:
+            raise NameError('Такой тренировки нет!')
+        if lap_samples is not None and lap_samples < 1:
+            raise ValueError('Длина круга должна быть положительной')
+        if not sample_interval > 0:
+            raise ValueError('Интервал отсчётов должен быть положительным')
+        training_class = WORKOUT_TYPES[workout_type]
+        self.workout_type = workout_type
+        self.sample_fields = training_class.SAMPLE_FIELDS
+        static = tuple(name for name in training_class.FIELDS
+                       if name not in self.sample_fields
+                       and name != 'duration')
+        if set(params) != set(static):
+            raise TypeError(f'Для {workout_type} нужны параметры '
+                            f'{", ".join(static)}')
+        self.params = params
+        self.sample_interval = sample_interval
+        self.lap_samples = lap_samples
+        self.samples = 0
+        self.totals: Dict[str, Union[int, float]] = dict.fromkeys(
+            self.sample_fields, 0)
+        self._lap_samples = 0
+        self._lap_totals = dict(self.totals)
+        self._laps: List[InfoMessage] = []
+
+    def feed(self, action: Iterable[Union[int, float]],
+             **counters: Iterable[Union[int, float]]) -> None:
+        """Добавить порцию отсчётов (списки, массивы или итераторы)."""
+        columns = {'action': action, **counters}
+        if set(columns) != set(self.sample_fields):
+            raise TypeError(f'Для {self.workout_type} нужны отсчёты '
+                            f'{", ".join(self.sample_fields)}')
+        columns = {name: values if hasattr(values, '__getitem__')
+                   and hasattr(values, '__len__') else list(values)
+                   for name, values in columns.items()}
+        size = len(columns['action'])
+        if any(len(values) != size for values in columns.values()):
+            raise ValueError('Порции отсчётов разной длины')
+        start = 0
+        while start < size:
+            take = size - start
+            if self.lap_samples is not None:
+                take = min(take, self.lap_samples - self._lap_samples)
+            for name, values in columns.items():
+                part = (values if take == size
+                        else values[start:start + take])
+                total = _sum_samples(part)
+                self.totals[name] += total
+                self._lap_totals[name] += total
+            self.samples += take
+            self._lap_samples += take
+            start += take
+            if self._lap_samples == self.lap_samples:
+                self._close_lap()
+
+    def _duration(self, samples: int) -> float:
+        return samples * self.sample_interval / self.SECONDS_IN_HOUR
+
+    def _training(self, totals: Mapping[str, Union[int, float]],
+                  samples: int) -> Training:
+        values = {**self.params, **totals,
+                  'duration': self._duration(samples)}
+        fields = WORKOUT_TYPES[self.workout_type].FIELDS
+        return read_package(self.workout_type,
+                            [values[name] for name in fields])
+
+    def _close_lap(self) -> None:
+        self._laps.append(self._training(self._lap_totals,
+                                         self._lap_samples)
+                          .show_training_info())
+        self._lap_samples = 0
+        self._lap_totals = dict.fromkeys(self.sample_fields, 0)
+
+    def to_training(self) -> Training:
+        """Тренировка с суммами всех полученных отсчётов.
+
+        До первого отсчёта бросает ValueError: длительность ещё нулевая.
+        """
+        if not self.samples:
+            raise ValueError('Отсчётов ещё нет, тренировку не посчитать')
+        return self._training(self.totals, self.samples)
+
+    def get_distance(self) -> float:
+        return self.to_training().get_distance()
+
+    def get_mean_speed(self) -> float:
+        return self.to_training().get_mean_speed()
+
+    def get_spent_calories(self) -> float:
+        return self.to_training().get_spent_calories()
+
+    def show_training_info(self) -> InfoMessage:
+        return self.to_training().show_training_info()
+
+    def laps(self) -> List[InfoMessage]:
+        """Итоги законченных кругов и текущего неполного круга."""
+        laps = list(self._laps)
+        if self._lap_samples:
+            laps.append(self._training(self._lap_totals, self._lap_samples)
+                        .show_training_info())
+        return laps
+
+
+PACKAGE_ERRORS = (NameError, TypeError, ValueError, ZeroDivisionError,
+                  OverflowError)
+ERROR_MODES = ('raise', 'skip', 'count')
+# Причина отказа validate_batch и исключение, которое было бы при расчёте.
+REJECT_ERRORS: Dict[str, type] = {
+    'parse': ValueError,
+    'unknown_type': NameError,
+    'arity': TypeError,
+    'type': TypeError,
+    'range': ValueError,
+    'zero': ZeroDivisionError,
+}
+NUMBER_TYPES = frozenset((int, float))
+# Нижняя граница полей-делителей и верхняя граница полей без FIELD_LIMITS.
+MIN_POSITIVE = 1e-6
+MAX_FIELD_VALUE = 1e9
+
+
+def _bad_positions(values: Sequence, low: float, high: float) -> List[int]:
+    """Позиции значений колонки вне [low, high] или не чисел."""
+    # Быстрая проверка целой колонки встроенными функциями: сумма конечна,
+    # только если в колонке нет nan.
+    if values and NUMBER_TYPES.issuperset(map(type, values)):
+        total = sum(values)
+        if (total - total == 0 and min(values) >= low
+                and max(values) <= high):
+            return []
+    return [position for position, value in enumerate(values)
+            if type(value) not in NUMBER_TYPES
+            or not low <= value <= high]
+
+
+def _reject_reason(name: str, value: Any, low: float,
+                   high: float) -> Tuple[str, str]:
+    if type(value) not in NUMBER_TYPES:
+        return 'type', f'{name}: ожидалось число, получено {value!r}'
+    if low > 0 and value == 0:
+        return 'zero', f'{name} не может быть нулём'
+    return 'range', f'{name}={value!r} вне диапазона [{low}, {high}]'
+
+
+def _check_group(training_class: type, indexes: Sequence[int],
+                 columns: Iterable[Sequence],
+                 rejects: Dict[int, Tuple[str, str]]) -> None:
+    """Проверить колонки пакетов одного вида тренировки.
+
+    columns идут в порядке FIELDS; indexes — номера пакетов для rejects.
+    """
+    positive = training_class.POSITIVE_FIELDS
+    limits = training_class.FIELD_LIMITS
+    for name, column in zip(training_class.FIELDS, columns):
+        low = MIN_POSITIVE if name in positive else 0
+        high = limits.get(name, MAX_FIELD_VALUE)
+        for position in _bad_positions(column, low, high):
+            index = indexes[position]
+            if index not in rejects:
+                rejects[index] = _reject_reason(name, column[position],
+                                                low, high)
+
+
+def validate_batch(packages: Iterable[Union[Tuple[str, Sequence],
+                                            ValueError]]
+                   ) -> Tuple[List[Tuple[str, Sequence]],
+                              List[Tuple[int, str, str]]]:
+    """Отделить годные пакеты от плохих до расчёта.
+
+    Проверяются вид пакета (пара из кода-строки и списка или кортежа
+    параметров),
+    код тренировки, арность, тип (int или float, не bool), диапазон
+    (от нуля до FIELD_LIMITS, у полей POSITIVE_FIELDS — от MIN_POSITIVE)
+    и отличие от нуля полей POSITIVE_FIELDS. Пакеты группируются по коду
+    и проверяются по колонкам; годные пакеты считаются без исключений.
+    Ошибки разбора из iter_packages (ValueError) отклоняются как 'parse'.
+    Возвращает годные пакеты в исходном порядке и отказы
+    (номер пакета, причина из REJECT_ERRORS, описание).
+    """
+    packages = list(packages)
+    rejects: Dict[int, Tuple[str, str]] = {}
+    groups = {code: ([], [], len(training_class.FIELDS))
+              for code, training_class in WORKOUT_TYPES.items()}
+    for index, package in enumerate(packages):
+        if isinstance(package, ValueError):
+            rejects[index] = ('parse', str(package))
+            continue
+        if (type(package) not in (list, tuple) or len(package) != 2
+                or type(package[0]) is not str
+                or type(package[1]) not in (list, tuple)):
+            rejects[index] = ('type', 'Пакет должен быть строкой кода и '
+                              f'списком параметров, получено {package!r}')
+            continue
+        workout_type, data = package
+        group = groups.get(workout_type)
+        if group is None:
+            rejects[index] = ('unknown_type', 'Такой тренировки нет!')
+        elif len(data) != group[2]:
+            rejects[index] = ('arity', f'{workout_type} принимает '
+                              f'{group[2]} параметров, получено {len(data)}')
+        else:
+            group[0].append(index)
+            group[1].append(data)
+    for workout_type, (indexes, rows, _) in groups.items():
+        if indexes:
+            _check_group(WORKOUT_TYPES[workout_type], indexes, zip(*rows),
+                         rejects)
+    if not rejects:
+        return packages, []
+    valid = [package for index, package in enumerate(packages)
+             if index not in rejects]
+    return valid, [(index, *rejects[index]) for index in sorted(rejects)]
+
+
+class StreamStats:
+    """Счётчики потоковой обработки пакетов."""
+    __slots__ = ('processed', 'skipped', 'last_error')
+
+    def __init__(self, processed: int = 0, skipped: int = 0,
+                 last_error: Optional[str] = None) -> None:
+        self.processed = processed
+        self.skipped = skipped
+        self.last_error = last_error
+
+    def __repr__(self) -> str:
+        return (f'StreamStats(processed={self.processed}, '
+                f'skipped={self.skipped}, last_error={self.last_error!r})')
+
+
+def _parse_number(value: str) -> Union[int, float]:
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def parse_json_record(line: str) -> Tuple[str, List[Union[int, float]]]:
+    """Разобрать пакет из строки JSON: ["SWM", [...]] или объект."""
+    import json
+    return _record_package(json.loads(line), line)
+
+
+def _record_package(record: Any, line: str
+                    ) -> Tuple[str, List[Union[int, float]]]:
+    if isinstance(record, dict):
+        try:
+            return record['workout_type'], record['data']
+        except KeyError as exc:
+            raise ValueError(f'В пакете нет поля {exc}')
+    if isinstance(record, list) and len(record) == 2:
+        return record[0], record[1]
+    raise ValueError(f'Неверный формат пакета: {line!r}')
+
+
+def _iter_json_packages(lines: Iterable[str]
+                        ) -> Iterator[Union[Tuple[str, list], ValueError]]:
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield parse_json_record(line)
+        except ValueError as exc:
+            yield exc
+
+
+def _iter_csv_packages(lines: Iterable[str]
+                       ) -> Iterator[Union[Tuple[str, list], ValueError]]:
+    import csv
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        try:
+            yield row[0].strip(), [_parse_number(value) for value in row[1:]]
+        except ValueError as exc:
+            yield exc
+
+
+PACKAGE_READERS = {
+    'jsonl': _iter_json_packages,
+    'csv': _iter_csv_packages,
+}
+
+
+def iter_packages(lines: Iterable[str], fmt: str = 'jsonl'
+                  ) -> Iterator[Union[Tuple[str, list], ValueError]]:
+    """Лениво прочитать пакеты из строк JSON Lines или CSV.
+
+    Ошибки разбора строки не прерывают поток, а возвращаются
+    вместо пакета, чтобы вызывающий код решил, что с ними делать.
+    """
+    if fmt not in PACKAGE_READERS:
+        raise ValueError(f'Неизвестный формат пакетов: {fmt}')
+    return PACKAGE_READERS[fmt](lines)
+
+
+def _validated(chunk: List[Union[Tuple[str, list], ValueError]],
+               errors: str, stats: StreamStats) -> List[Tuple[str, list]]:
+    """Годные пакеты порции; плохие обрабатываются по режиму errors."""
+    valid, rejects = validate_batch(chunk)
+    _handle_rejects(rejects, errors, stats)
+    return valid
+
+
+def _handle_rejects(rejects: List[Tuple[int, str, str]], errors: str,
+                    stats: StreamStats) -> None:
+    if rejects and errors == 'raise':
+        _, reason, detail = rejects[0]
+        raise REJECT_ERRORS[reason](detail)
+    if rejects and errors == 'count':
+        _, reason, detail = rejects[-1]
+        stats.skipped += len(rejects)
+        stats.last_error = f'{REJECT_ERRORS[reason].__name__}: {detail}'
+
+
+def _process_chunk(chunk: List[Union[Tuple[str, list], ValueError]],
+                   errors: str, stats: StreamStats) -> List[InfoMessage]:
+    results = [read_package(workout_type, data).show_training_info()
+               for workout_type, data in _validated(chunk, errors, stats)]
+    stats.processed += len(results)
+    return results
+
+
+def stream_results(lines: Iterable[str], fmt: str = 'jsonl',
+                   chunk_size: int = 1000, errors: str = 'raise',
+                   stats: Optional[StreamStats] = None
+                   ) -> Iterator[InfoMessage]:
+    """Лениво вернуть InfoMessage для каждого пакета из потока строк.
+
+    Строки читаются порциями по chunk_size, поэтому память не зависит
+    от размера входа. errors: 'raise' — пробросить ошибку плохого пакета,
+    'skip' — молча пропустить, 'count' — пропустить и учесть в stats.
+    """
+    if errors not in ERROR_MODES:
+        raise ValueError(f'Неизвестный режим ошибок: {errors}')
+    if chunk_size < 1:
+        raise ValueError('Размер порции должен быть положительным')
+    if stats is None:
+        stats = StreamStats()
+    packages = iter_packages(lines, fmt)
+    while True:
+        chunk = list(islice(packages, chunk_size))
+        if not chunk:
+            return
+        yield from _process_chunk(chunk, errors, stats)
+
+
+def stream_file(path: str, fmt: Optional[str] = None,
+                chunk_size: int = 1000, errors: str = 'raise',
+                stats: Optional[StreamStats] = None
+                ) -> Iterator[InfoMessage]:
+    """Потоково обработать файл пакетов; формат берётся из расширения."""
+    if fmt is None:
+        fmt = 'csv' if path.endswith('.csv') else 'jsonl'
+    with open(path, encoding='utf-8', newline='') as file:
+        yield from stream_results(file, fmt, chunk_size, errors, stats)
+
+
+PACKED_MAGIC = b'HWPK'
+# Заголовок секции: сигнатура, код тренировки, число полей, число записей.
+PACKED_HEADER = struct.Struct('<4s3sBQ')
+
+
+def write_packed(stream: IO[bytes], workout_type: str,
+                 rows: Sequence[Sequence[Union[int, float]]]) -> int:
+    """Записать секцию пакетов одного вида в двоичном формате.
+
+    Секция — заголовок PACKED_HEADER и записи фиксированной длины:
+    поля FIELDS вида тренировки подряд как little-endian float64.
+    Код тренировки должен состоять ровно из 3 символов ASCII.
+    Возвращает число записанных байт.
+    """
+    from array import array
+    if workout_type not in WORKOUT_TYPES:
+        raise NameError('Такой тренировки нет!')
+    if not (workout_type.isascii() and len(workout_type) == 3):
+        raise ValueError(f'Код {workout_type!r} нельзя записать в двоичный '
+                         'формат: нужны ровно 3 символа ASCII')
+    arity = len(WORKOUT_TYPES[workout_type].FIELDS)
+    values = array('d')
+    for data in rows:
+        if len(data) != arity:
+            raise TypeError(f'Для {workout_type} нужно {arity} '
+                            f'параметров, получено {len(data)}')
+        values.extend(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    header = PACKED_HEADER.pack(PACKED_MAGIC, workout_type.encode('ascii'),
+                                arity, len(rows))
+    stream.write(header)
+    stream.write(values.tobytes())
+    return len(header) + values.itemsize * len(values)
+
+
+def pack_packages(packages: Iterable[Tuple[str, Sequence]],
+                  stream: IO[bytes], chunk_size: int = 100_000) -> int:
+    """Перевести пакеты из списочного формата в двоичный.
+
+    Пакеты группируются по виду внутри порций по chunk_size, поэтому
+    порядок пакетов разных видов в файле не сохраняется.
+    Возвращает число записанных пакетов.
+    """
+    count = 0
+    for chunk in _chunked(packages, chunk_size):
+        groups: Dict[str, list] = {}
+        for workout_type, data in chunk:
+            groups.setdefault(workout_type, []).append(data)
+        for workout_type, rows in groups.items():
+            write_packed(stream, workout_type, rows)
+        count += len(chunk)
+    return count
+
+
+def convert_to_packed(source: str, target: str, fmt: Optional[str] = None,
+                      chunk_size: int = 100_000) -> int:
+    """Перевести файл пакетов JSON Lines или CSV в двоичный формат."""
+    if fmt is None:
+        fmt = 'csv' if source.endswith('.csv') else 'jsonl'
+
+    def packages(lines: Iterable[str]) -> Iterator[Tuple[str, list]]:
+        for package in iter_packages(lines, fmt):
+            if isinstance(package, ValueError):
+                raise package
+            yield package
+    with open(source, encoding='utf-8', newline='') as src, \
+            open(target, 'wb') as dst:
+        return pack_packages(packages(src), dst, chunk_size)
+
+
+class PackedFile:
+    """Чтение двоичного файла пакетов через mmap без копирования.
+
+    sections() возвращает для каждой секции код тренировки и колонки —
+    срезы memoryview поверх отображённого файла. Колонки действительны,
+    пока файл открыт.
+    """
+
+    def __init__(self, path: str) -> None:
+        import mmap
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = (mmap.mmap(self._file.fileno(), 0,
+                                access=mmap.ACCESS_READ) if size else None)
+        self._views: List[memoryview] = []
+
+    def _view(self, start: int, stop: int) -> Union[memoryview, array]:
+        if sys.byteorder != 'little':
+            from array import array
+            values = array('d', self._mmap[start:stop])
+            values.byteswap()
+            return values
+        view = memoryview(self._mmap)[start:stop]
+        self._views.append(view)
+        values = view.cast('d')
+        self._views.append(values)
+        return values
+
+    def sections(self) -> Iterator[Tuple[str, Dict[str, Sequence[float]]]]:
+        """Пройти по секциям файла по порядку."""
+        offset = 0
+        size = len(self._mmap) if self._mmap is not None else 0
+        while offset < size:
+            magic, code, arity, count = PACKED_HEADER.unpack_from(
+                self._mmap, offset)
+            workout_type = code.decode('ascii')
+            if magic != PACKED_MAGIC:
+                raise ValueError(f'Повреждённый файл {self.path}: '
+                                 f'нет сигнатуры по смещению {offset}')
+            if workout_type not in WORKOUT_TYPES:
+                raise NameError('Такой тренировки нет!')
+            fields = WORKOUT_TYPES[workout_type].FIELDS
+            if arity != len(fields):
+                raise ValueError(f'В секции {workout_type} {arity} полей, '
+                                 f'ожидалось {len(fields)}')
+            start = offset + PACKED_HEADER.size
+            offset = start + count * arity * 8
+            if offset > size:
+                raise ValueError(f'Файл {self.path} обрезан')
+            values = self._view(start, offset)
+            columns = {name: values[index::arity]
+                       for index, name in enumerate(fields)}
+            if isinstance(values, memoryview):
+                self._views.extend(columns.values())
+            yield workout_type, columns
+
+    def compute(self) -> Iterator[Tuple[str, Dict[str, list]]]:
+        """Рассчитать каждую секцию через compute_batch."""
+        for workout_type, columns in self.sections():
+            count = len(columns['duration'])
+            yield workout_type, compute_batch([workout_type] * count,
+                                              columns)
+
+    def close(self) -> None:
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> 'PackedFile':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+COLUMNAR_MAGIC = b'HWCF'
+COLUMNAR_VERSION = 1
+# Заголовок файла: сигнатура и версия формата.
+COLUMNAR_HEAD = struct.Struct('<4sI')
+# Хвост файла: длина метаданных JSON и сигнатура.
+COLUMNAR_TAIL = struct.Struct('<I4s')
+COLUMNAR_TYPES = {'training_type': 'H', 'duration': 'd', 'distance': 'd',
+                  'speed': 'd', 'calories': 'd'}
+
+
+class ColumnarWriter:
+    """Запись результатов в колоночный файл группами строк.
+
+    Файл: сигнатура, группы строк, метаданные JSON и хвост COLUMNAR_TAIL.
+    В группе каждая колонка лежит непрерывным блоком little-endian
+    значений; training_type хранится словарём строк группы и индексами
+    uint16. В памяти держится не больше одной группы строк.
+    """
+
+    def __init__(self, file: Union[str, IO[bytes]],
+                 row_group_size: int = 65_536) -> None:
+        if row_group_size < 1:
+            raise ValueError('Размер группы строк должен быть положительным')
+        from array import array
+        self._own = isinstance(file, str)
+        self._file = open(file, 'wb') if self._own else file
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self._row_groups: List[Dict[str, Any]] = []
+        self._dictionary: Dict[str, int] = {}
+        self._columns = {name: array(typecode)
+                         for name, typecode in COLUMNAR_TYPES.items()}
+        self._file.write(COLUMNAR_HEAD.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION))
+        self._offset = COLUMNAR_HEAD.size
+
+    def write(self, info: InfoMessage) -> None:
+        """Добавить один результат."""
+        self.write_row(_message_fields(info))
+
+    def write_row(self, row: Sequence) -> None:
+        """Добавить результат как кортеж полей в порядке MESSAGE_FIELDS."""
+        columns = self._columns
+        dictionary = self._dictionary
+        training_type = row[0]
+        index = dictionary.get(training_type)
+        if index is None:
+            index = dictionary[training_type] = len(dictionary)
+        columns['training_type'].append(index)
+        columns['duration'].append(row[1])
+        columns['distance'].append(row[2])
+        columns['speed'].append(row[3])
+        columns['calories'].append(row[4])
+        if len(columns['duration']) >= self.row_group_size:
+            self.flush()
+
+    def write_many(self, results: Iterable[InfoMessage]) -> None:
+        for info in results:
+            self.write_row(_message_fields(info))
+
+    def write_columns(self, columns: Mapping[str, Sequence]) -> None:
+        """Добавить результаты прямо из колонок compute_batch."""
+        for row in zip(*(columns[name] for name in MESSAGE_FIELDS)):
+            self.write_row(row)
+
+    def flush(self) -> None:
+        """Записать накопленную группу строк."""
+        size = len(self._columns['duration'])
+        if not size:
+            return
+        from array import array
+        metadata: Dict[str, Any] = {'rows': size, 'columns': {}}
+        for name, values in self._columns.items():
+            if sys.byteorder != 'little':
+                values.byteswap()
+            data = values.tobytes()
+            self._file.write(data)
+            column = {'offset': self._offset, 'length': len(data),
+                      'type': values.typecode}
+            if name == 'training_type':
+                column['dictionary'] = list(self._dictionary)
+            metadata['columns'][name] = column
+            self._offset += len(data)
+            self._columns[name] = array(values.typecode)
+        self._dictionary = {}
+        self._row_groups.append(metadata)
+        self.rows += size
+
+    def close(self) -> None:
+        """Записать последнюю группу и метаданные."""
+        import json
+        if self._file is None:
+            return
+        self.flush()
+        footer = json.dumps({
+            'version': COLUMNAR_VERSION,
+            'columns': list(COLUMNAR_TYPES),
+            'rows': self.rows,
+            'row_groups': self._row_groups,
+        }, ensure_ascii=False).encode('utf-8')
+        self._file.write(footer)
+        self._file.write(COLUMNAR_TAIL.pack(len(footer), COLUMNAR_MAGIC))
+        if self._own:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+
+    def __enter__(self) -> 'ColumnarWriter':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class ColumnarReader:
+    """Чтение колоночного файла ColumnarWriter.
+
+    Читаются только блоки запрошенных колонок, остальные пропускаются.
+    """
+
+    def __init__(self, path: str) -> None:
+        import json
+        self.path = path
+        self._file = open(path, 'rb')
+        magic, version = COLUMNAR_HEAD.unpack(
+            self._file.read(COLUMNAR_HEAD.size))
+        if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+            self._file.close()
+            raise ValueError(f'{path} — не колоночный файл результатов')
+        self._file.seek(-COLUMNAR_TAIL.size, os.SEEK_END)
+        length, magic = COLUMNAR_TAIL.unpack(
+            self._file.read(COLUMNAR_TAIL.size))
+        if magic != COLUMNAR_MAGIC:
+            self._file.close()
+            raise ValueError(f'{path} — не колоночный файл результатов')
+        self._file.seek(-COLUMNAR_TAIL.size - length, os.SEEK_END)
+        self.metadata = json.loads(self._file.read(length))
+        self.columns: List[str] = self.metadata['columns']
+        self.num_rows: int = self.metadata['rows']
+
+    def _read_column(self, column: Mapping[str, Any]) -> list:
+        from array import array
+        self._file.seek(column['offset'])
+        values = array(column['type'])
+        values.frombytes(self._file.read(column['length']))
+        if sys.byteorder != 'little':
+            values.byteswap()
+        if 'dictionary' in column:
+            dictionary = column['dictionary']
+            return [dictionary[index] for index in values]
+        return values.tolist()
+
+    def iter_row_groups(self, columns: Optional[Sequence[str]] = None
+                        ) -> Iterator[Dict[str, list]]:
+        """Пройти по группам строк, читая только колонки columns."""
+        names = self.columns if columns is None else list(columns)
+        unknown = set(names) - set(self.columns)
+        if unknown:
+            raise KeyError(f'Нет колонок {sorted(unknown)}')
+        for row_group in self.metadata['row_groups']:
+            yield {name: self._read_column(row_group['columns'][name])
+                   for name in names}
+
+    def read(self, columns: Optional[Sequence[str]] = None
+             ) -> Dict[str, list]:
+        """Прочитать колонки целиком."""
+        names = self.columns if columns is None else list(columns)
+        result: Dict[str, list] = {name: [] for name in names}
+        for row_group in self.iter_row_groups(names):
+            for name, values in row_group.items():
+                result[name].extend(values)
+        return result
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> 'ColumnarReader':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class Aggregate:
+    """Накопленные итоги тренировок по одному ключу."""
+    __slots__ = ('workouts', 'duration', 'distance', 'calories',
+                 'speed_duration', 'by_type')
+
+    def __init__(self) -> None:
+        self.workouts = 0
+        self.duration = 0.0
+        self.distance = 0.0
+        self.calories = 0.0
+        self.speed_duration = 0.0
+        self.by_type: Dict[str, int] = {}
+
+    def add(self, info: InfoMessage) -> None:
+        """Учесть одну тренировку за O(1)."""
+        self.workouts += 1
+        self.duration += info.duration
+        self.distance += info.distance
+        self.calories += info.calories
+        self.speed_duration += info.speed * info.duration
+        by_type = self.by_type
+        by_type[info.training_type] = by_type.get(info.training_type, 0) + 1
+
+    def merge(self, other: 'Aggregate') -> None:
+        """Добавить итоги другого агрегата."""
+        self.workouts += other.workouts
+        self.duration += other.duration
+        self.distance += other.distance
+        self.calories += other.calories
+        self.speed_duration += other.speed_duration
+        for training_type, count in other.by_type.items():
+            self.by_type[training_type] = (
+                self.by_type.get(training_type, 0) + count)
+
+    @property
+    def mean_speed(self) -> float:
+        """Средняя скорость, взвешенная по длительности тренировок."""
+        return self.speed_duration / self.duration if self.duration else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values: Mapping[str, Any]) -> 'Aggregate':
+        aggregate = cls()
+        for name in cls.__slots__:
+            setattr(aggregate, name, values[name])
+        aggregate.by_type = dict(aggregate.by_type)
+        return aggregate
+
+
+def _hashable_key(key: Any) -> Hashable:
+    """Вернуть ключ из JSON к исходному виду: списки — снова кортежи."""
+    if isinstance(key, list):
+        return tuple(_hashable_key(part) for part in key)
+    return key
+
+
+class Aggregator:
+    """Инкрементальные итоги тренировок по ключам (например, пользователь
+    и день).
+
+    Память растёт с числом ключей, а не записей. Частичные итоги
+    из разных процессов объединяются merge().
+    """
+
+    def __init__(self) -> None:
+        self.aggregates: Dict[Hashable, Aggregate] = {}
+
+    def update(self, key: Hashable,
+               result: Union[InfoMessage, Training]) -> None:
+        """Учесть результат тренировки для ключа."""
+        if not isinstance(result, InfoMessage):
+            result = result.show_training_info()
+        aggregate = self.aggregates.get(key)
+        if aggregate is None:
+            aggregate = self.aggregates[key] = Aggregate()
+        aggregate.add(result)
+
+    def update_many(self, records: Iterable[
+            Tuple[Hashable, Union[InfoMessage, Training]]]) -> None:
+        """Учесть поток пар (ключ, результат)."""
+        for key, result in records:
+            self.update(key, result)
+
+    def merge(self, other: 'Aggregator') -> 'Aggregator':
+        """Добавить частичные итоги другого агрегатора."""
+        for key, aggregate in other.aggregates.items():
+            target = self.aggregates.get(key)
+            if target is None:
+                target = self.aggregates[key] = Aggregate()
+            target.merge(aggregate)
+        return self
+
+    def rollup(self, key_func: Callable[[Hashable], Hashable]
+               ) -> 'Aggregator':
+        """Свернуть итоги по новому ключу, например (user, day) -> user."""
+        result = Aggregator()
+        for key, aggregate in self.aggregates.items():
+            target = result.aggregates.get(key_func(key))
+            if target is None:
+                target = result.aggregates[key_func(key)] = Aggregate()
+            target.merge(aggregate)
+        return result
+
+    def to_dict(self) -> List[List[Any]]:
+        """Итоги для JSON списком пар [ключ, итог].
+
+        Ключи сохраняются как есть: кортеж (user, day) становится списком
+        и восстанавливается from_dict обратно в кортеж.
+        """
+        return [[key, aggregate.to_dict()]
+                for key, aggregate in self.aggregates.items()]
+
+    @classmethod
+    def from_dict(cls, values: Iterable[Sequence[Any]]) -> 'Aggregator':
+        aggregator = cls()
+        for key, aggregate in values:
+            aggregator.aggregates[_hashable_key(key)] = (
+                Aggregate.from_dict(aggregate))
+        return aggregator
+
+    def __getitem__(self, key: Hashable) -> Aggregate:
+        return self.aggregates[key]
+
+    def __len__(self) -> int:
+        return len(self.aggregates)
+
+
+class ResultCache:
+    """LRU-кэш результатов для повторяющихся пакетов.
+
+    Ключ — код тренировки и параметры, приведённые к float, поэтому
+    [15000, 1, 75] и [15000.0, 1.0, 75.0] дают одну запись. Записи старше
+    ttl секунд считаются устаревшими. С path результаты дополнительно
+    сохраняются в sqlite и переживают перезапуск процесса; в файле
+    остаются не больше disk_maxsize самых свежих записей, устаревшие
+    удаляются при чтении и в flush().
+    """
+    COMMIT_EVERY = 1000
+    _db: Optional[sqlite3.Connection]
+
+    def __init__(self, maxsize: int = 100_000, ttl: Optional[float] = None,
+                 path: Optional[str] = None,
+                 disk_maxsize: int = 1_000_000) -> None:
+        if maxsize < 1 or disk_maxsize < 1:
+            raise ValueError('Размер кэша должен быть положительным')
+        self.maxsize = maxsize
+        self.disk_maxsize = disk_maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: Dict[tuple, Tuple[tuple, float]] = {}
+        self._db = None
+        self._pending = 0
+        if path is not None:
+            import sqlite3
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, training_type TEXT, duration REAL, '
+                'distance REAL, speed REAL, calories REAL, created REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_created '
+                             'ON results (created)')
+
+    @staticmethod
+    def key(workout_type: str, data: Sequence[Union[int, float]]
+            ) -> Optional[tuple]:
+        """Нормализованный ключ пакета или None, если пакет не кэшируется.
+
+        Как и в validate_batch, числами считаются только int и float:
+        строки и bool не должны совпадать с ключом корректного пакета.
+        """
+        if (type(workout_type) is not str or type(data) not in (list, tuple)
+                or not NUMBER_TYPES.issuperset(map(type, data))):
+            return None
+        return workout_type, tuple(map(float, data))
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key: tuple, row: tuple, created: float) -> None:
+        # Словарь хранит порядок вставки: первый ключ — самый старый.
+        entries = self._entries
+        entries.pop(key, None)
+        entries[key] = (row, created)
+        if len(entries) > self.maxsize:
+            del entries[next(iter(entries))]
+            self.evictions += 1
+
+    def _load(self, key: tuple, now: float) -> Optional[tuple]:
+        import json
+        found = self._db.execute(
+            'SELECT training_type, duration, distance, speed, calories, '
+            'created FROM results WHERE key = ?',
+            (json.dumps(key),)).fetchone()
+        if found is None:
+            return None
+        if self._expired(found[-1], now):
+            self._db.execute('DELETE FROM results WHERE key = ?',
+                             (json.dumps(key),))
+            self._pending += 1
+            return None
+        self._remember(key, found[:-1], found[-1])
+        return found[:-1]
+
+    def _store(self, key: tuple, row: tuple, created: float) -> None:
+        import json
+        self._db.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (json.dumps(key), *row, created))
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.flush()
+
+    def get(self, workout_type: str,
+            data: Sequence[Union[int, float]]) -> InfoMessage:
+        """Вернуть результат пакета из кэша или рассчитать его."""
+        key = self.key(workout_type, data)
+        if key is None:
+            return read_package(workout_type, data).show_training_info()
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and not self._expired(entry[1], now):
+            self._entries[key] = self._entries.pop(key)
+            self.hits += 1
+            return InfoMessage(*entry[0])
+        if entry is not None:
+            del self._entries[key]
+        if self._db is not None:
+            row = self._load(key, now)
+            if row is not None:
+                self.disk_hits += 1
+                return InfoMessage(*row)
+        self.misses += 1
+        info = read_package(workout_type, data).show_training_info()
+        row = _message_fields(info)
+        self._remember(key, row, now)
+        if self._db is not None:
+            self._store(key, row, now)
+        return info
+
+    def process(self, packages: Iterable[Tuple[str, Sequence]]
+                ) -> Iterator[InfoMessage]:
+        """Лениво обработать поток пакетов через кэш."""
+        for workout_type, data in packages:
+            yield self.get(workout_type, data)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Счётчики попаданий и промахов."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': ((self.hits + self.disk_hits) / lookups
+                         if lookups else 0.0),
+        }
+
+    def clear(self) -> None:
+        """Очистить кэш в памяти (сохранённые на диске записи остаются)."""
+        self._entries.clear()
+
+    def _prune(self) -> None:
+        # Удалить устаревшие записи и самые старые сверх disk_maxsize.
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM results WHERE created < ?',
+                             (time.time() - self.ttl,))
+        self._db.execute(
+            'DELETE FROM results WHERE key IN (SELECT key FROM results '
+            'ORDER BY created DESC LIMIT -1 OFFSET ?)', (self.disk_maxsize,))
+
+    def flush(self) -> None:
+        """Записать на диск накопленные изменения."""
+        if self._db is not None:
+            self._prune()
+            self._db.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __enter__(self) -> 'ResultCache':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class _CacheStripe:
+    """Часть кэша TrainingProcessor со своим замком."""
+    __slots__ = ('lock', 'entries', 'maxsize', 'hits', 'misses', 'evictions')
+
+    def __init__(self, lock: threading.Lock, maxsize: int) -> None:
+        self.lock = lock
+        self.entries: Dict[tuple, tuple] = {}
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class TrainingProcessor:
+    """Обработчик пакетов, который можно делить между потоками.
+
+    Владеет копией таблицы конструкторов, LRU-кэшем результатов и
+    метриками. Таблица заменяется целиком при add_workout/remove_workout,
+    поэтому чтение идёт без блокировок. Кэш разбит на stripes частей со
+    своими замками: потоки с разными ключами почти не ждут друг друга.
+    Метрики каждый поток пишет в свой Metrics, metrics() их складывает;
+    глобальную METRICS, которая не защищена замком, обработчик не трогает.
+    Тренировки создаются на каждый вызов и между потоками не делятся.
+    """
+
+    def __init__(self, cache_size: int = 100_000, stripes: int = 16,
+                 metrics: bool = False,
+                 constructors: Optional[Mapping[str, Callable]] = None
+                 ) -> None:
+        import threading
+        if cache_size < 0 or stripes < 1:
+            raise ValueError('Размер кэша и число частей должны быть '
+                             'положительными')
+        self._constructors = dict(WORKOUT_CONSTRUCTORS if constructors is None
+                                  else constructors)
+        self._lock = threading.Lock()
+        self._stripes = [
+            _CacheStripe(threading.Lock(), -(-cache_size // stripes))
+            for _ in range(stripes if cache_size else 0)
+        ]
+        self._collect_metrics = metrics
+        self._local = threading.local()
+        self._thread_metrics: List[Metrics] = []
+
+    def _metrics(self) -> Metrics:
+        metrics = getattr(self._local, 'metrics', None)
+        if metrics is None:
+            metrics = self._local.metrics = Metrics()
+            with self._lock:
+                self._thread_metrics.append(metrics)
+        return metrics
+
+    def add_workout(self, code: str, training_class: type) -> None:
+        """Добавить вид тренировки только в таблицу этого обработчика."""
+        constructor = _make_constructor(training_class,
+                                        len(_init_fields(training_class)))
+        with self._lock:
+            if code in self._constructors:
+                raise ValueError(f'Код тренировки {code} уже занят')
+            self._constructors = {**self._constructors, code: constructor}
+
+    def remove_workout(self, code: str) -> None:
+        """Убрать вид тренировки и сбросить кэш."""
+        with self._lock:
+            if code not in self._constructors:
+                raise NameError('Такой тренировки нет!')
+            constructors = dict(self._constructors)
+            del constructors[code]
+            self._constructors = constructors
+        self.clear()
+
+    def read_package(self, workout_type: str,
+                     data: Sequence[Union[int, float]]) -> Training:
+        """То же, что read_package(), по таблице обработчика."""
+        started = perf_counter() if self._collect_metrics else 0.0
+        try:
+            construct = self._constructors[workout_type]
+        except KeyError:
+            raise NameError('Такой тренировки нет!')
+        training = construct(data)
+        if self._collect_metrics:
+            self._metrics().observe('read_package', workout_type,
+                                    perf_counter() - started)
+        return training
+
+    def _show(self, training: Training) -> InfoMessage:
+        # Training.show_training_info пишет в METRICS; здесь время идёт
+        # в Metrics потока. Переопределённый метод вызывается как есть.
+        if (type(training).show_training_info
+                is not Training.show_training_info):
+            return training.show_training_info()
+        if not self._collect_metrics:
+            return training._info()
+        started = perf_counter()
+        info = training._info()
+        self._metrics().observe('show_training_info', training.CODE,
+                                perf_counter() - started)
+        return info
+
+    def process(self, workout_type: str,
+                data: Sequence[Union[int, float]]) -> InfoMessage:
+        """Вернуть результат пакета из кэша или рассчитать его."""
+        key = ResultCache.key(workout_type, data) if self._stripes else None
+        if key is None:
+            return self._show(self.read_package(workout_type, data))
+        stripe = self._stripes[hash(key) % len(self._stripes)]
+        with stripe.lock:
+            row = stripe.entries.pop(key, None)
+            if row is not None:
+                stripe.entries[key] = row
+                stripe.hits += 1
+        if row is not None:
+            return InfoMessage(*row)
+        info = self._show(self.read_package(workout_type, data))
+        with stripe.lock:
+            stripe.misses += 1
+            stripe.entries[key] = _message_fields(info)
+            if len(stripe.entries) > stripe.maxsize:
+                del stripe.entries[next(iter(stripe.entries))]
+                stripe.evictions += 1
+        return info
+
+    def process_many(self, packages: Iterable[Tuple[str, Sequence]]
+                     ) -> Iterator[InfoMessage]:
+        """Лениво обработать поток пакетов."""
+        for workout_type, data in packages:
+            yield self.process(workout_type, data)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Сумма счётчиков кэша по всем частям."""
+        totals = dict.fromkeys(('size', 'hits', 'misses', 'evictions'), 0)
+        for stripe in self._stripes:
+            with stripe.lock:
+                totals['size'] += len(stripe.entries)
+                totals['hits'] += stripe.hits
+                totals['misses'] += stripe.misses
+                totals['evictions'] += stripe.evictions
+        lookups = totals['hits'] + totals['misses']
+        return {**totals,
+                'hit_rate': totals['hits'] / lookups if lookups else 0.0}
+
+    def metrics(self) -> Metrics:
+        """Снимок метрик всех потоков в одном объекте Metrics."""
+        with self._lock:
+            thread_metrics = list(self._thread_metrics)
+        merged = Metrics()
+        for metrics in thread_metrics:
+            merged.merge(metrics)
+        return merged
+
+    def clear(self) -> None:
+        """Очистить кэш."""
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+
+
+def _error_line(exc: BaseException) -> bytes:
+    import json
+    response = {'error': f'{type(exc).__name__}: {exc}'}
+    return json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def process_json_line(line: Union[str, bytes]) -> bytes:
+    """Обработать один пакет JSON и вернуть строку ответа JSON.
+
+    Ответ — поля InfoMessage или {"error": ...} для пакета, расчёт
+    которого завершился любой ошибкой: один пакет не обрывает соединение.
+    """
+    import json
+    try:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        workout_type, data = parse_json_record(line)
+        info = read_package(workout_type, data).show_training_info()
+    except Exception as exc:
+        return _error_line(exc)
+    response = dict(zip(MESSAGE_FIELDS, _message_fields(info)))
+    return json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class IngestServer:
+    """Asyncio-сервер приёма пакетов по TCP или Unix-сокету.
+
+    Клиент присылает пакеты JSON по одному на строку и получает ответы
+    process_json_line в том же порядке. На каждое соединение не больше
+    queue_size пакетов в работе: когда очередь заполнена, сервер перестаёт
+    читать сокет, и давление передаётся клиенту через TCP. concurrency
+    ограничивает число одновременных расчётов на весь сервер; с executor
+    расчёты выполняются в нём, иначе — в цикле событий.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 unix_path: Optional[str] = None, queue_size: int = 100,
+                 concurrency: int = 8,
+                 executor: Optional[Executor] = None) -> None:
+        if queue_size < 1 or concurrency < 1:
+            raise ValueError('queue_size и concurrency должны быть '
+                             'положительными')
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.executor = executor
+        self.processed = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> Any:
+        """Начать приём соединений и вернуть адрес сервера."""
+        import asyncio
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self.unix_path is not None:
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=self.unix_path)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port)
+        return self.address
+
+    @property
+    def address(self) -> Any:
+        """Адрес первого слушающего сокета."""
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self) -> 'IngestServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    async def _process(self, line: bytes) -> bytes:
+        async with self._semaphore:
+            if self.executor is None:
+                response = process_json_line(line)
+            else:
+                import asyncio
+                loop = asyncio.get_running_loop()
+                try:
+                    response = await loop.run_in_executor(
+                        self.executor, process_json_line, line)
+                except Exception as exc:
+                    # Например, сломанный пул процессов.
+                    response = _error_line(exc)
+        self.processed += 1
+        return response
+
+    async def _read(self, reader: asyncio.StreamReader,
+                    pending: asyncio.Queue) -> None:
+        import asyncio
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError) as exc:
+                    # Строка длиннее лимита StreamReader или обрыв: сообщить
+                    # клиенту ошибку и перестать читать это соединение.
+                    failed = asyncio.get_running_loop().create_future()
+                    failed.set_result(_error_line(exc))
+                    await pending.put(failed)
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(
+                        asyncio.ensure_future(self._process(line)))
+        finally:
+            await pending.put(None)
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        import asyncio
+        pending: asyncio.Queue = asyncio.Queue(self.queue_size)
+        read_task = asyncio.ensure_future(self._read(reader, pending))
+        try:
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                writer.write(await task)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            read_task.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+            writer.close()
+
+
+async def _open_connection(address: Any) -> Tuple[asyncio.StreamReader,
+                                                  asyncio.StreamWriter]:
+    import asyncio
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+    return await asyncio.open_connection(*address[:2])
+
+
+async def send_packages(address: Any,
+                        packages: Iterable[Tuple[str, Sequence]]
+                        ) -> List[Dict[str, Any]]:
+    """Отправить пакеты на IngestServer и вернуть ответы по порядку."""
+    import asyncio
+    import json
+    reader, writer = await _open_connection(address)
+    lines = [json.dumps([workout_type, list(data)]).encode() + b'\n'
+             for workout_type, data in packages]
+
+    async def write() -> None:
+        for line in lines:
+            writer.write(line)
+            await writer.drain()
+        writer.write_eof()
+    write_task = asyncio.ensure_future(write())
+    try:
+        responses = [json.loads(await reader.readline()) for _ in lines]
+        await write_task
+    finally:
+        write_task.cancel()
+        writer.close()
+    return responses
+
+
+async def load_test(address: Any, packages: Sequence[Tuple[str, Sequence]],
+                    connections: int = 4, repeat: int = 1
+                    ) -> Dict[str, float]:
+    """Нагрузить сервер с нескольких соединений и замерить пропускную
+    способность. Каждое соединение отправляет packages repeat раз."""
+    import asyncio
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        send_packages(address, list(packages) * repeat)
+        for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+    total = sum(len(responses) for responses in results)
+    errors = sum('error' in response
+                 for responses in results for response in responses)
+    return {'packages': total, 'errors': errors, 'seconds': elapsed,
+            'packages_per_second': total / elapsed if elapsed else 0.0}
+
+
+SHARD_KEYS = ('workout_type', 'user')
+
+
+def _keyed_record(line: str, by: str
+                  ) -> Tuple[str, Union[Tuple[str, list], ValueError]]:
+    """Ключ шардирования и пакет из строки JSON за один разбор.
+
+    Ключ user берётся из поля "user" объекта; у записей без него
+    ключ — пустая строка.
+    """
+    import json
+    try:
+        record = json.loads(line)
+        package: Union[Tuple[str, list], ValueError] = _record_package(
+            record, line)
+    except ValueError as exc:
+        return '', exc
+    if by == 'workout_type':
+        return str(package[0]), package
+    user = record.get('user', '') if isinstance(record, dict) else ''
+    return str(user), package
+
+
+def process_shard(lines: Iterable[str], by: str = 'workout_type'
+                  ) -> Dict[str, Any]:
+    """Обработать порцию строк JSON Lines и вернуть итоги по ключу by.
+
+    Пакеты проверяются validate_batch, затем каждый считается через
+    read_package и учитывается в Aggregator. Результат пригоден для JSON.
+    """
+    keys: List[str] = []
+    packages: List[Union[Tuple[str, list], ValueError]] = []
+    for line in lines:
+        if line.strip():
+            key, package = _keyed_record(line, by)
+            keys.append(key)
+            packages.append(package)
+    valid, rejects = validate_batch(packages)
+    rejected = {index for index, _, _ in rejects}
+    aggregator = Aggregator()
+    valid_keys = [key for index, key in enumerate(keys)
+                  if index not in rejected]
+    for key, (workout_type, data) in zip(valid_keys, valid):
+        aggregator.update(key, read_package(workout_type, data))
+    return {'processed': len(valid), 'skipped': len(rejects),
+            'aggregates': aggregator.to_dict()}
+
+
+def shard_worker(address: Tuple[str, int], authkey: bytes) -> int:
+    """Обработчик порций: подключиться к координатору и считать порции,
+    пока он не пришлёт None. Возвращает число обработанных порций.
+
+    Запускается в отдельном процессе на этой или другой машине::
+
+        python -c "import homework; homework.shard_worker(
+            ('10.0.0.1', 6000), b'секрет')"
+    """
+    from multiprocessing.connection import Client
+    done = 0
+    with Client(tuple(address), authkey=authkey) as connection:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            shard, by, lines = message
+            connection.send((shard, process_shard(lines, by)))
+            done += 1
+    return done
+
+
+class ShardCoordinator:
+    """Координатор шардированной обработки файла пакетов JSON Lines.
+
+    partition() раскладывает строки по shards файлам в workdir по
+    crc32 ключа by ('workout_type' или 'user'). run() раздаёт порции
+    обработчикам shard_worker через multiprocessing.connection, собирает
+    итоги в Aggregator и после каждой порции атомарно пишет контрольную
+    точку в workdir/checkpoint.json. Порция, обработчик которой отвалился,
+    возвращается в очередь, но не больше retries раз. Повторный run() с
+    тем же workdir и неизменным входом пропускает готовые порции.
+    """
+    CHECKPOINT = 'checkpoint.json'
+
+    def __init__(self, path: str, workdir: str, shards: int = 8,
+                 by: str = 'workout_type', retries: int = 2,
+                 address: Tuple[str, int] = ('127.0.0.1', 0),
+                 authkey: Optional[bytes] = None) -> None:
+        if by not in SHARD_KEYS:
+            raise ValueError(f'Неизвестный ключ шардирования: {by}')
+        if shards < 1:
+            raise ValueError('Число порций должно быть положительным')
+        import threading
+        self.path = path
+        self.workdir = workdir
+        self.shards = shards
+        self.by = by
+        self.retries = retries
+        self.address = address
+        self.authkey = authkey if authkey is not None else os.urandom(16)
+        self.dispatched = 0
+        self.stats = StreamStats()
+        self._done: Dict[int, Dict[str, Any]] = {}
+        self._pending: List[int] = []
+        self._in_flight: set = set()
+        self._attempts: Dict[int, int] = {}
+        self._error: Optional[Exception] = None
+        self._condition = threading.Condition()
+
+    def shard_path(self, shard: int) -> str:
+        return os.path.join(self.workdir, f'shard-{shard:04d}.jsonl')
+
+    def _signature(self) -> Dict[str, Any]:
+        status = os.stat(self.path)
+        return {'path': os.path.abspath(self.path), 'size': status.st_size,
+                'mtime': status.st_mtime, 'shards': self.shards,
+                'by': self.by}
+
+    def _load_checkpoint(self) -> bool:
+        """Восстановить готовые порции, если вход не изменился."""
+        import json
+        checkpoint = os.path.join(self.workdir, self.CHECKPOINT)
+        if not os.path.exists(checkpoint):
+            return False
+        with open(checkpoint, encoding='utf-8') as file:
+            state = json.load(file)
+        if state['input'] != self._signature():
+            return False
+        self._done = {int(shard): result
+                      for shard, result in state['done'].items()}
+        return True
+
+    def _save_checkpoint(self) -> None:
+        import json
+        checkpoint = os.path.join(self.workdir, self.CHECKPOINT)
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'input': self._signature(), 'done': self._done},
+                      file, ensure_ascii=False)
+        os.replace(temporary, checkpoint)
+
+    def partition(self) -> List[str]:
+        """Разложить вход по файлам порций и сбросить контрольную точку."""
+        import zlib
+        os.makedirs(self.workdir, exist_ok=True)
+        files = [open(self.shard_path(shard), 'w', encoding='utf-8')
+                 for shard in range(self.shards)]
+        try:
+            with open(self.path, encoding='utf-8') as source:
+                for line in source:
+                    if line.strip():
+                        key, _ = _keyed_record(line, self.by)
+                        shard = zlib.crc32(key.encode()) % self.shards
+                        files[shard].write(line)
+        finally:
+            for file in files:
+                file.close()
+        self._done = {}
+        self._save_checkpoint()
+        return [file.name for file in files]
+
+    def _next_shard(self) -> Optional[int]:
+        """Следующая порция; None, когда раздавать больше нечего."""
+        with self._condition:
+            while (not self._pending and self._in_flight
+                   and self._error is None):
+                self._condition.wait()
+            if not self._pending or self._error is not None:
+                return None
+            shard = self._pending.pop()
+            self._in_flight.add(shard)
+            self.dispatched += 1
+            return shard
+
+    def _complete(self, shard: int, result: Dict[str, Any]) -> None:
+        with self._condition:
+            self._done[shard] = result
+            self._save_checkpoint()
+            self._in_flight.discard(shard)
+            self._condition.notify_all()
+
+    def _fail(self, shard: int) -> None:
+        with self._condition:
+            self._in_flight.discard(shard)
+            attempts = self._attempts[shard] = self._attempts.get(shard,
+                                                                  0) + 1
+            if attempts > self.retries:
+                self._error = RuntimeError(
+                    f'Порция {shard} не обработана за {attempts} попыток')
+            else:
+                self._pending.append(shard)
+            self._condition.notify_all()
+
+    def _serve(self, connection: Connection) -> None:
+        """Раздавать порции одному обработчику, пока они есть."""
+        with connection:
+            while True:
+                shard = self._next_shard()
+                if shard is None:
+                    try:
+                        connection.send(None)
+                    except OSError:
+                        pass
+                    return
+                with open(self.shard_path(shard), encoding='utf-8') as file:
+                    lines = file.readlines()
+                try:
+                    connection.send((shard, self.by, lines))
+                    _, result = connection.recv()
+                except (EOFError, OSError):
+                    self._fail(shard)
+                    return
+                self._complete(shard, result)
+
+    def _accept(self, listener: Listener, stopped: threading.Event) -> None:
+        import threading
+        from multiprocessing import AuthenticationError
+        while not stopped.is_set():
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                continue
+            if stopped.is_set():
+                connection.close()
+                return
+            threading.Thread(target=self._serve, args=(connection,),
+                             daemon=True).start()
+
+    def _remaining(self) -> bool:
+        return bool(self._pending or self._in_flight) and self._error is None
+
+    def _start_worker(self) -> subprocess.Popen:
+        """Запустить shard_worker отдельным интерпретатором.
+
+        Новый процесс не наследует потоки и замки координатора, как при
+        fork, и получает ключ через окружение, а не командную строку.
+        """
+        import subprocess
+        path = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, HOMEWORK_AUTHKEY=self.authkey.hex(),
+                   PYTHONPATH=os.pathsep.join(
+                       filter(None, (path, os.environ.get('PYTHONPATH')))))
+        code = ('import os, homework; homework.shard_worker('
+                f'{tuple(self.address)!r}, '
+                'bytes.fromhex(os.environ["HOMEWORK_AUTHKEY"]))')
+        return subprocess.Popen([sys.executable, '-c', code], env=env)
+
+    def _supervise(self, workers: int) -> List[subprocess.Popen]:
+        """Держать workers живых обработчиков, пока есть порции."""
+        processes: List[subprocess.Popen] = []
+        limit = workers + self.shards * (self.retries + 1)
+        with self._condition:
+            while self._remaining():
+                alive = sum(process.poll() is None for process in processes)
+                for _ in range(min(workers, len(self._pending)) - alive):
+                    if len(processes) >= limit:
+                        self._error = RuntimeError(
+                            'Обработчики порций завершаются с ошибкой')
+                        break
+                    processes.append(self._start_worker())
+                self._condition.wait(0.1)
+            self._condition.notify_all()
+        return processes
+
+    def run(self, workers: Optional[int] = None) -> Aggregator:
+        """Обработать все порции и вернуть объединённые итоги.
+
+        workers — число локальных процессов shard_worker (по умолчанию
+        по числу ядер); упавший процесс заменяется новым. С workers=0
+        координатор только ждёт внешних обработчиков на self.address.
+        """
+        import socket
+        import subprocess
+        import threading
+        from multiprocessing.connection import Listener
+        if not self._load_checkpoint():
+            self.partition()
+        self._pending = [shard for shard in reversed(range(self.shards))
+                         if shard not in self._done]
+        self._error = None
+        if workers is None:
+            workers = min(os.cpu_count() or 1, len(self._pending))
+        stopped = threading.Event()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            self.address = listener.address
+            acceptor = threading.Thread(target=self._accept,
+                                        args=(listener, stopped), daemon=True)
+            acceptor.start()
+            processes = self._supervise(workers)
+            stopped.set()
+            # Разбудить accept(): пустое соединение не пройдёт проверку.
+            socket.create_connection(self.address).close()
+            acceptor.join()
+        for process in processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self._error is not None:
+            raise self._error
+        return self.result()
+
+    def result(self) -> Aggregator:
+        """Объединить итоги готовых порций."""
+        aggregator = Aggregator()
+        self.stats = StreamStats()
+        for result in self._done.values():
+            aggregator.merge(Aggregator.from_dict(result['aggregates']))
+            self.stats.processed += result['processed']
+            self.stats.skipped += result['skipped']
+        return aggregator
 
 
 def main(training: Training) -> None:
@@ -130,13 +2744,200 @@ def main(training: Training) -> None:
     print(info.get_message())
 
 
-if __name__ == '__main__':
-    packages = [
-        ('SWM', [720, 1, 80, 25, 40]),
-        ('RUN', [15000, 1, 75]),
-        ('WLK', [9000, 1, 75, 180])
-    ]
+def _lines_from_files(paths: Sequence[str]) -> Iterator[str]:
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+            continue
+        with open(path, encoding='utf-8', newline='') as file:
+            yield from file
 
-    for workout_type, data in packages:
-        training = read_package(workout_type, data)
-        main(training)
+
+def _valid_columns(workout_type: str, columns: Dict[str, Sequence[float]],
+                   errors: str, stats: StreamStats
+                   ) -> Dict[str, Sequence[float]]:
+    """Колонки секции без плохих строк; проверка как в validate_batch."""
+    training_class = WORKOUT_TYPES[workout_type]
+    rows = range(len(columns['duration']))
+    rejects: Dict[int, Tuple[str, str]] = {}
+    _check_group(training_class, rows,
+                 (columns[name] for name in training_class.FIELDS), rejects)
+    if not rejects:
+        return columns
+    _handle_rejects([(index, *rejects[index]) for index in sorted(rejects)],
+                    errors, stats)
+    keep = [index for index in rows if index not in rejects]
+    return {name: [column[index] for index in keep]
+            for name, column in columns.items()}
+
+
+def _packed_results(paths: Sequence[str], errors: str,
+                    stats: StreamStats) -> Iterator[InfoMessage]:
+    for path in paths:
+        with PackedFile(path) as packed:
+            for workout_type, columns in packed.sections():
+                columns = _valid_columns(workout_type, columns, errors,
+                                         stats)
+                count = len(columns['duration'])
+                results = compute_batch([workout_type] * count, columns)
+                stats.processed += count
+                for row in zip(*(results[name] for name in BATCH_COLUMNS)):
+                    yield InfoMessage(*row)
+
+
+def _valid_packages(lines: Iterable[str], fmt: str, errors: str,
+                    stats: StreamStats, chunk_size: int
+                    ) -> Iterator[Tuple[str, list]]:
+    for chunk in _chunked(iter_packages(lines, fmt), chunk_size):
+        yield from _validated(chunk, errors, stats)
+
+
+def iter_cli_results(args: argparse.Namespace,
+                     stats: StreamStats) -> Iterator[InfoMessage]:
+    """Результаты для входных файлов командной строки."""
+    paths = args.files or ['-']
+    fmt = args.input_format
+    if fmt is None:
+        fmt = ('packed' if paths[0].endswith('.bin')
+               else 'csv' if paths[0].endswith('.csv') else 'jsonl')
+    if fmt == 'packed':
+        if '-' in paths:
+            raise ValueError('Двоичный формат нельзя читать из stdin')
+        if args.workers != 1:
+            raise ValueError('Двоичный формат считается в одном процессе, '
+                             '-w/--workers с ним не поддерживается')
+        return _packed_results(paths, args.errors, stats)
+    lines = _lines_from_files(paths)
+    if args.workers == 1:
+        return stream_results(lines, fmt, args.chunk_size, args.errors,
+                              stats)
+    return process_parallel(
+        _valid_packages(lines, fmt, args.errors, stats, args.chunk_size),
+        args.workers, args.chunk_size)
+
+
+def _write_text(results: Iterable[InfoMessage], stream: IO[str],
+                chunk_size: int) -> int:
+    return write_messages(results, stream, chunk_size)
+
+
+def _write_jsonl(results: Iterable[InfoMessage], stream: IO[str],
+                 chunk_size: int) -> int:
+    import json
+    lines = (json.dumps(dict(zip(MESSAGE_FIELDS, _message_fields(info))),
+                        ensure_ascii=False) for info in results)
+    return _write_lines(lines, stream, chunk_size)
+
+
+def _write_csv(results: Iterable[InfoMessage], stream: IO[str],
+               chunk_size: int) -> int:
+    import csv
+    writer = csv.writer(stream, lineterminator='\n')
+    writer.writerow(MESSAGE_FIELDS)
+    count = 0
+    for chunk in _chunked(map(_message_fields, results), chunk_size):
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+def _write_columnar(results: Iterable[InfoMessage], stream: IO[bytes],
+                    chunk_size: int) -> int:
+    with ColumnarWriter(stream, row_group_size=chunk_size) as writer:
+        writer.write_many(results)
+    return writer.rows
+
+
+OUTPUT_WRITERS: Dict[str, Callable[[Iterable[InfoMessage], IO, int],
+                                   int]] = {
+    'text': _write_text,
+    'jsonl': _write_jsonl,
+    'csv': _write_csv,
+    'columnar': _write_columnar,
+}
+
+BINARY_OUTPUTS = ('columnar',)
+
+
+def peak_memory(children: bool = False) -> Optional[int]:
+    """Пиковый объём памяти процесса в байтах, если его можно узнать.
+
+    С children=True — наибольший пик среди завершённых дочерних процессов
+    (например, рабочих процессов process_parallel).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _memory_text(peak: Optional[int]) -> str:
+    return f'{peak / 2 ** 20:.1f} МиБ' if peak else 'неизвестно'
+
+
+def build_parser() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='homework',
+        description='Рассчитать результаты тренировок по пакетам датчиков.')
+    parser.add_argument('files', nargs='*',
+                        help='файлы пакетов; без файлов или "-" — stdin')
+    parser.add_argument('-i', '--input-format',
+                        choices=('jsonl', 'csv', 'packed'),
+                        help='формат входа; по умолчанию по расширению')
+    parser.add_argument('-f', '--format', choices=tuple(OUTPUT_WRITERS),
+                        default='text', help='формат вывода')
+    parser.add_argument('-o', '--output', help='файл вывода, иначе stdout')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='число процессов (0 — по числу ядер)')
+    parser.add_argument('--chunk-size', type=int, default=10_000,
+                        help='размер порции чтения и записи')
+    parser.add_argument('--errors', choices=ERROR_MODES, default='raise',
+                        help='что делать с плохими пакетами')
+    parser.add_argument('--stats', action='store_true',
+                        help='вывести в stderr скорость и пиковую память')
+    return parser
+
+
+def cli(argv: Optional[Sequence[str]] = None) -> int:
+    """Точка входа командной строки."""
+    args = build_parser().parse_args(argv)
+    if args.workers == 0:
+        args.workers = None
+    stats = StreamStats()
+    started = perf_counter()
+    if args.format in BINARY_OUTPUTS:
+        output = (open(args.output, 'wb') if args.output
+                  else sys.stdout.buffer)
+    else:
+        output = (open(args.output, 'w', encoding='utf-8', newline='')
+                  if args.output else sys.stdout)
+    try:
+        results = iter_cli_results(args, stats)
+        count = OUTPUT_WRITERS[args.format](results, output, args.chunk_size)
+    except (*PACKAGE_ERRORS, OSError) as exc:
+        print(f'Ошибка: {type(exc).__name__}: {exc}', file=sys.stderr)
+        return 1
+    finally:
+        if args.output:
+            output.close()
+        else:
+            output.flush()
+    if args.stats:
+        elapsed = perf_counter() - started
+        memory = _memory_text(peak_memory())
+        if args.workers != 1:
+            memory += (f' (обработчики: '
+                       f'{_memory_text(peak_memory(children=True))})')
+        print(f'Записей: {count}; пропущено: {stats.skipped}; '
+              f'время: {elapsed:.3f} с; '
+              f'записей в секунду: {count / elapsed if elapsed else 0:.0f}; '
+              f'пиковая память: {memory}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
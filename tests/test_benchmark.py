@@ -0,0 +1,36 @@
+import pytest
+
+import benchmark
+import homework
+
+
+def test_synthetic_packages_are_valid():
+    packages = list(benchmark.synthetic_packages(300, seed=1))
+    assert len(packages) == 300
+    assert packages == list(benchmark.synthetic_packages(300, seed=1)), (
+        'Синтетические данные должны зависеть только от seed.'
+    )
+    for workout_type, data in packages:
+        homework.read_package(workout_type, data).show_training_info()
+
+
+@pytest.mark.parametrize('baseline, current, expected', [
+    ({'get_message.Running': 100}, {'get_message.Running': 105}, []),
+    ({'get_message.Running': 100}, {'get_message.Running': 150},
+     ['get_message.Running']),
+    ({'throughput.batch.1000': 1000}, {'throughput.batch.1000': 800},
+     ['throughput.batch.1000']),
+    ({'throughput.batch.1000': 1000}, {'throughput.batch.1000': 1200}, []),
+    ({'removed': 1}, {'added': 100}, []),
+])
+def test_compare(baseline, current, expected):
+    slowdowns = benchmark.compare(baseline, current, threshold=0.1)
+    assert [name for name, _ in slowdowns] == expected
+
+
+def test_contention_reports_every_thread_count():
+    result = benchmark.contention(threads=(1, 4), count=200, repeat=1)
+    assert sorted(result) == [f'throughput.contention.{mode}.{threads}'
+                              for mode in ('cold', 'warm')
+                              for threads in (1, 4)]
+    assert all(value > 0 for value in result.values())
@@ -1,8 +1,19 @@
+import asyncio
+import csv
+import io
+import json
 import re
+import socket
 import pytest
 import types
 import inspect
-from conftest import Capturing
+import itertools
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from conftest import BASE_DIR, Capturing
 
 try:
     import homework
@@ -363,3 +374,1107 @@ def test_main_output(input_data, expected):
     assert get_message_output == expected, (
         'Метод `main` должен печатать результат в консоль.\n'
     )
+
+
+BATCH_PACKAGES = [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+    ('RUN', [1206, 12, 6]),
+    ('SWM', [1206, 12, 6, 12, 6]),
+    ('WLK', [420, 4, 20, 42]),
+    ('RUN', [420, 4, 20]),
+]
+
+
+def test_compute_batch_matches_scalar():
+    assert hasattr(homework, 'compute_batch'), (
+        'Создайте функцию пакетного расчёта `compute_batch`.'
+    )
+    workout_types, columns = homework.packages_to_columns(BATCH_PACKAGES)
+    result = homework.compute_batch(workout_types, columns)
+    for index, (workout_type, data) in enumerate(BATCH_PACKAGES):
+        info = homework.read_package(workout_type, data).show_training_info()
+        for name in homework.BATCH_COLUMNS:
+            assert result[name][index] == getattr(info, name), (
+                f'Пакетный расчёт `{name}` для {workout_type} {data} '
+                'должен совпадать с расчётом через класс тренировки.'
+            )
+
+
+def test_compute_batch_unknown_type():
+    with pytest.raises(NameError):
+        homework.compute_batch(['XXX'], {'action': [1], 'duration': [1],
+                                         'weight': [1]})
+
+
+def test_stream_results_jsonl():
+    lines = [
+        '["SWM", [720, 1, 80, 25, 40]]\n',
+        '\n',
+        '{"workout_type": "RUN", "data": [1206, 12, 6]}\n',
+    ]
+    result = [info.get_message()
+              for info in homework.stream_results(lines, chunk_size=1)]
+    assert result == [
+        homework.read_package('SWM', [720, 1, 80, 25, 40])
+        .show_training_info().get_message(),
+        homework.read_package('RUN', [1206, 12, 6])
+        .show_training_info().get_message(),
+    ], 'Поток должен возвращать сообщения для каждого пакета по порядку.'
+
+
+def test_stream_results_csv_file(tmp_path):
+    path = tmp_path / 'packages.csv'
+    path.write_text('WLK,9000,1,75,180\nRUN,15000,1.0,75\n', encoding='utf-8')
+    result = list(homework.stream_file(str(path)))
+    assert [info.training_type for info in result] == [
+        'SportsWalking', 'Running'
+    ]
+    assert result[1].calories == homework.Running(
+        15000, 1, 75).get_spent_calories()
+
+
+@pytest.mark.parametrize('errors, expected, skipped', [
+    ('skip', 1, 0),
+    ('count', 1, 4),
+])
+def test_stream_results_bad_records(errors, expected, skipped):
+    lines = [
+        'not json\n',
+        '["XXX", [1, 2, 3]]\n',
+        '["RUN", [1, 2]]\n',
+        '["RUN", [1, 0, 3]]\n',
+        '["RUN", [15000, 1, 75]]\n',
+    ]
+    stats = homework.StreamStats()
+    result = list(homework.stream_results(lines, errors=errors, stats=stats))
+    assert len(result) == expected
+    assert stats.processed == expected
+    assert stats.skipped == skipped
+
+
+def test_stream_results_raise():
+    with pytest.raises(TypeError):
+        list(homework.stream_results(['["RUN", [1, 2]]']))
+
+
+def test_stream_results_malformed_packages():
+    lines = [
+        '["RUN", 5]\n',
+        '{"workout_type": "RUN", "data": null}\n',
+        '[["RUN"], [1, 2, 3]]\n',
+        '["RUN", [15000, 1, 75]]\n',
+    ]
+    stats = homework.StreamStats()
+    result = list(homework.stream_results(lines, errors='count',
+                                          stats=stats))
+    assert [info.training_type for info in result] == ['Running']
+    assert (stats.processed, stats.skipped) == (1, 3), (
+        'Пакеты без списка параметров или со странным кодом должны '
+        'отклоняться, а не обрывать поток.'
+    )
+    _, rejects = homework.validate_batch(
+        homework.parse_json_record(line) for line in lines)
+    assert [reason for _, reason, _ in rejects] == ['type'] * 3
+
+
+@pytest.mark.parametrize('package, reason', [
+    (ValueError('плохая строка'), 'parse'),
+    (('XXX', [1, 2, 3]), 'unknown_type'),
+    (('RUN', [1, 2]), 'arity'),
+    (('RUN', ['15000', 1, 75]), 'type'),
+    (('RUN', [15000, True, 75]), 'type'),
+    (('RUN', [15000, 1, -75]), 'range'),
+    (('RUN', [15000, 1, float('nan')]), 'range'),
+    (('RUN', [15000, 0, 75]), 'zero'),
+    (('WLK', [9000, 1, 75, 0]), 'zero'),
+    (('SWM', [720, 1, 80, 25, float('inf')]), 'range'),
+    (('WLK', [1e205, 1, 75, 180]), 'range'),
+    (('RUN', [15000, 1e-300, 75]), 'range'),
+    (('RUN', [15000, 1, 75], 'x'), 'type'),
+    (('RUN',), 'type'),
+    ('RUN', 'type'),
+    (None, 'type'),
+])
+def test_validate_batch_rejects(package, reason):
+    good = ('RUN', [15000, 1, 75])
+    valid, rejects = homework.validate_batch([good, package, good])
+    assert valid == [good, good]
+    assert [(index, found) for index, found, _ in rejects] == [(1, reason)]
+    # Пакет не из двух элементов в JSON отклоняется ещё при разборе.
+    pair = isinstance(package, tuple) and len(package) == 2
+    with pytest.raises(homework.REJECT_ERRORS[reason] if pair
+                       else ValueError):
+        list(homework.stream_results(
+            [json.dumps(package) if pair else 'not json']))
+
+
+def test_validate_batch_valid_rows_compute(cycling):
+    packages = BATCH_PACKAGES + [('CYC', [1000, 2, 70, 80]),
+                                 ('RUN', [0, 1, 75])]
+    valid, rejects = homework.validate_batch(iter(packages))
+    assert valid == packages and rejects == []
+    homework.compute_batch(*homework.packages_to_columns(valid))
+    valid, rejects = homework.validate_batch(
+        [('CYC', [1000, 0, 70, 80]), ('SWM', [720, 0, -80, 25, 40])])
+    assert valid == []
+    assert rejects == [
+        (0, 'zero', 'duration не может быть нулём'),
+        (1, 'zero', 'duration не может быть нулём'),
+    ], 'У пакета сообщается первая по порядку полей причина отказа.'
+
+
+@pytest.mark.parametrize('workout_type', ['RUN', 'WLK', 'SWM'])
+def test_validate_batch_limits_prevent_overflow(workout_type):
+    training_class = homework.WORKOUT_TYPES[workout_type]
+    bounds = [
+        (homework.MIN_POSITIVE if name in training_class.POSITIVE_FIELDS
+         else 0,
+         training_class.FIELD_LIMITS.get(name, homework.MAX_FIELD_VALUE))
+        for name in training_class.FIELDS
+    ]
+    packages = [(workout_type, list(row))
+                for row in itertools.product(*bounds)]
+    valid, rejects = homework.validate_batch(packages)
+    assert rejects == [], 'Границы диапазона должны проходить проверку.'
+    for package in valid:
+        homework.read_package(*package).show_training_info()
+    homework.compute_batch(*homework.packages_to_columns(valid))
+
+
+def test_stream_results_skips_overflow():
+    lines = ['["WLK", [1e205, 1, 75, 180]]', '["RUN", [15000, 1, 75]]']
+    assert len(list(homework.stream_results(lines, errors='skip'))) == 1
+
+
+def test_packages_to_columns_arity():
+    with pytest.raises(TypeError):
+        homework.packages_to_columns([('RUN', [1, 2])])
+    with pytest.raises(NameError):
+        homework.packages_to_columns([('XXX', [1, 2, 3])])
+
+
+@pytest.mark.parametrize('workers, ordered', [
+    (1, True),
+    (2, True),
+    (2, False),
+])
+def test_process_parallel(workers, ordered):
+    packages = BATCH_PACKAGES * 5
+    expected = [homework.read_package(*package).show_training_info()
+                for package in packages]
+    result = list(homework.process_parallel(
+        packages, workers=workers, chunk_size=3, ordered=ordered))
+    if ordered:
+        assert result == expected, (
+            'Параллельная обработка должна сохранять порядок пакетов.'
+        )
+    else:
+        key = lambda info: info.get_message()  # noqa: E731
+        assert sorted(result, key=key) == sorted(expected, key=key)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_process_parallel_bounded_input(ordered):
+    pulled = 0
+
+    def endless():
+        nonlocal pulled
+        for package in itertools.cycle(BATCH_PACKAGES):
+            pulled += 1
+            yield package
+
+    packages = endless()
+    result = homework.process_parallel(
+        packages, workers=2, chunk_size=10, ordered=ordered)
+    taken = list(itertools.islice(result, 5))
+    time.sleep(0.2)
+    assert len(taken) == 5
+    assert pulled <= 10 * (2 * 2 + 1), (
+        'process_parallel не должен вычитывать вход дальше окна порций.'
+    )
+    result.close()
+
+
+@pytest.mark.parametrize('workout_type, data', BATCH_PACKAGES)
+def test_slotted_types(workout_type, data):
+    slotted = homework.SLOTTED_TYPES[workout_type](*data)
+    assert not hasattr(slotted, '__dict__'), (
+        'У экземпляров slotted-вариантов не должно быть `__dict__`.'
+    )
+    expected = homework.read_package(workout_type, data).show_training_info()
+    assert slotted.show_training_info() == expected
+
+
+def test_InfoMessage_slots():
+    info = homework.InfoMessage('Running', 1, 2, 3, 4)
+    assert not hasattr(info, '__dict__'), (
+        'У `InfoMessage` должны быть объявлены `__slots__`.'
+    )
+
+
+def test_TrainingBatch():
+    rows = [data for workout_type, data in BATCH_PACKAGES
+            if workout_type == 'RUN']
+    batch = homework.TrainingBatch('RUN', rows)
+    assert len(batch) == len(rows)
+    assert batch.nbytes == len(rows) * 3 * 8
+    assert batch[1].show_training_info() == homework.Running(
+        *rows[1]).show_training_info()
+    result = batch.compute()
+    for index, data in enumerate(rows):
+        info = homework.Running(*data).show_training_info()
+        assert result['calories'][index] == info.calories
+    with pytest.raises(TypeError):
+        batch.append([1, 2])
+
+
+def test_compile_template():
+    template, names = homework.compile_template('{a}% {b:.3f}')
+    assert template == '%s%% %.3f'
+    assert names == ('a', 'b')
+    assert homework.compile_template('{{a}} {b}') == ('{a} %s', ('b',))
+    for bad in ('{a!r}', '{a', 'a}', '{0}'):
+        with pytest.raises(ValueError):
+            homework.compile_template(bad)
+
+
+def test_write_messages_matches_get_message():
+    from io import StringIO
+    infos = [homework.read_package(*package).show_training_info()
+             for package in BATCH_PACKAGES]
+    expected = ''.join(info.get_message() + '\n' for info in infos)
+    assert list(homework.format_messages(infos)) == [
+        info.get_message() for info in infos
+    ]
+    stream = StringIO()
+    assert homework.write_messages(infos, stream, chunk_size=2) == len(infos)
+    assert stream.getvalue() == expected, (
+        'Пакетный вывод должен совпадать с `get_message` побайтно.'
+    )
+    stream = StringIO()
+    columns = homework.compute_batch(
+        *homework.packages_to_columns(BATCH_PACKAGES))
+    assert homework.write_columns(columns, stream) == len(infos)
+    assert stream.getvalue() == expected
+
+
+def test_metrics_are_cached(monkeypatch):
+    calls = []
+    get_distance = homework.Training.get_distance.__wrapped__
+
+    def counting_get_distance(self):
+        calls.append(self)
+        return get_distance(self)
+    monkeypatch.setattr(homework.Training, 'get_distance',
+                        homework.cached_metric(counting_get_distance))
+    running = homework.Running(15000, 1, 75)
+    running.show_training_info()
+    assert len(calls) == 1, (
+        'Дистанция должна рассчитываться один раз на экземпляр.'
+    )
+
+
+@pytest.mark.parametrize('workout_type, data, name, value', [
+    ('RUN', [15000, 1, 75], 'duration', 2),
+    ('WLK', [9000, 1, 75, 180], 'height', 150),
+    ('SWM', [720, 1, 80, 25, 40], 'count_pool', 20),
+])
+def test_metrics_cache_invalidation(workout_type, data, name, value):
+    training = homework.read_package(workout_type, data)
+    training.show_training_info()
+    setattr(training, name, value)
+    changed = list(data)
+    changed[training.FIELDS.index(name)] = value
+    expected = homework.read_package(workout_type, changed)
+    assert training.show_training_info() == expected.show_training_info(), (
+        'Изменение параметра тренировки должно сбрасывать кэш расчётов.'
+    )
+
+
+def test_frozen_training():
+    training = homework.read_package('RUN', [15000, 1, 75], frozen=True)
+    assert training._metrics, 'Показатели должны рассчитываться сразу.'
+    with pytest.raises(AttributeError):
+        training.duration = 2
+    assert training.show_training_info() == homework.Running(
+        15000, 1, 75).show_training_info()
+    slotted = homework.SLOTTED_TYPES['SWM'](720, 1, 80, 25, 40).freeze()
+    with pytest.raises(AttributeError):
+        slotted.count_pool = 1
+
+
+def test_read_package_unknown_type():
+    with pytest.raises(NameError):
+        homework.read_package('XXX', [1, 2, 3])
+
+
+def test_read_package_wrong_arity():
+    with pytest.raises(TypeError, match='Running'):
+        homework.read_package('RUN', [1, 2])
+    with pytest.raises(TypeError, match='Running'):
+        homework.read_package('RUN', iter([1, 2]))
+
+
+def test_read_package_iterable():
+    expected = homework.read_package('RUN', [15000, 1, 75])
+    for data in (iter([15000, 1, 75]), (value for value in [15000, 1, 75])):
+        assert homework.read_package('RUN', data).show_training_info() == (
+            expected.show_training_info()
+        ), 'read_package должен принимать итераторы, как и раньше.'
+
+
+@pytest.fixture
+def cycling():
+    @homework.register_workout('CYC')
+    class Cycling(homework.Training):
+        LEN_STEP = 5.5
+
+        def __init__(self, action, duration, weight, cadence):
+            super().__init__(action, duration, weight)
+            self.cadence = cadence
+
+        @homework.cached_metric
+        def get_spent_calories(self):
+            return self.cadence * self.get_mean_speed() * self.weight
+
+    yield Cycling
+    homework.unregister_workout('CYC')
+
+
+def test_register_workout(cycling):
+    assert cycling.FIELDS == ('action', 'duration', 'weight', 'cadence')
+    training = homework.read_package('CYC', [1000, 2, 70, 80])
+    assert isinstance(training, cycling)
+    info = training.show_training_info()
+    assert info.training_type == 'Cycling'
+    result = homework.compute_batch(
+        *homework.packages_to_columns([('CYC', [1000, 2, 70, 80])]))
+    assert result['calories'] == [info.calories], (
+        'Для подключённой тренировки без пакетных формул '
+        '`compute_batch` должен считать через методы класса.'
+    )
+    with pytest.raises(ValueError):
+        homework.register_workout('CYC')(cycling)
+
+
+def test_process_json_line():
+    response = json.loads(homework.process_json_line(
+        b'["RUN", [15000, 1, 75]]\n'))
+    info = homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    assert homework.InfoMessage(**response) == info
+    assert 'error' in json.loads(homework.process_json_line('["RUN", []]'))
+
+
+def test_ingest_server_tcp():
+    async def scenario():
+        async with homework.IngestServer(queue_size=2,
+                                         concurrency=2) as server:
+            responses = await homework.send_packages(
+                server.address, BATCH_PACKAGES + [('XXX', [1])])
+            stats = await homework.load_test(
+                server.address, BATCH_PACKAGES, connections=3, repeat=4)
+        return responses, stats, server.processed
+
+    responses, stats, processed = asyncio.run(scenario())
+    expected = [homework.read_package(*package).show_training_info()
+                for package in BATCH_PACKAGES]
+    assert [homework.InfoMessage(**response)
+            for response in responses[:-1]] == expected, (
+        'Сервер должен возвращать результаты в порядке пакетов.'
+    )
+    assert 'NameError' in responses[-1]['error']
+    assert stats['packages'] == 3 * 4 * len(BATCH_PACKAGES)
+    assert stats['errors'] == 0
+    assert processed == len(BATCH_PACKAGES) + 1 + stats['packages']
+
+
+def test_ingest_server_survives_errors(monkeypatch):
+    read_package = homework.read_package
+
+    def flaky_read_package(workout_type, data):
+        if data[0] == 13:
+            raise RuntimeError('сбой расчёта')
+        return read_package(workout_type, data)
+    monkeypatch.setattr(homework, 'read_package', flaky_read_package)
+
+    async def scenario():
+        async with homework.IngestServer() as server:
+            responses = await homework.send_packages(
+                server.address, [('RUN', [13, 1, 75]),
+                                 ('RUN', [15000, 1, 75])])
+            reader, writer = await asyncio.open_connection(
+                *server.address[:2])
+            writer.write(b'["RUN", [' + b'1, ' * 40_000 + b'1]]\n')
+            await writer.drain()
+            too_long = json.loads(await reader.readline())
+            writer.close()
+        return responses, too_long
+
+    responses, too_long = asyncio.run(scenario())
+    assert 'RuntimeError' in responses[0]['error']
+    assert homework.InfoMessage(**responses[1]) == read_package(
+        'RUN', [15000, 1, 75]).show_training_info(), (
+        'Ошибка одного пакета не должна обрывать соединение.'
+    )
+    assert 'ValueError' in too_long['error'], (
+        'Об ошибке чтения строки сервер должен сообщить клиенту.'
+    )
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason='Unix-сокеты недоступны')
+def test_ingest_server_unix(tmp_path):
+    path = str(tmp_path / 'ingest.sock')
+    with ThreadPoolExecutor(2) as executor:
+        async def scenario():
+            async with homework.IngestServer(unix_path=path,
+                                             executor=executor):
+                return await homework.send_packages(path, BATCH_PACKAGES)
+        responses = asyncio.run(scenario())
+    assert len(responses) == len(BATCH_PACKAGES)
+
+
+@pytest.fixture
+def metrics():
+    yield homework.enable_metrics()
+    homework.disable_metrics()
+
+
+def test_metrics_disabled_by_default():
+    assert homework.METRICS is None, 'Сбор метрик должен быть выключен.'
+
+
+def test_metrics_collection(metrics, tmp_path):
+    for package in BATCH_PACKAGES:
+        homework.read_package(*package).show_training_info().get_message()
+    assert metrics.count('read_package', 'RUN') == 3
+    assert metrics.count('show_training_info', 'SWM') == 2
+    assert metrics.count('get_message', 'WLK') == 2
+    text = metrics.to_prometheus()
+    assert ('homework_operations_total{operation="read_package",'
+            'workout_type="RUN"} 3') in text
+    assert ('homework_operation_seconds_bucket{operation="get_message",'
+            'workout_type="WLK",le="+Inf"} 2') in text
+    path = tmp_path / 'metrics.prom'
+    metrics.write_prometheus(str(path))
+    assert path.read_text(encoding='utf-8') == text
+
+
+def test_serve_metrics(metrics):
+    from urllib.request import urlopen
+    homework.read_package('RUN', [15000, 1, 75])
+    server = homework.serve_metrics()
+    try:
+        host, port = server.server_address[:2]
+        with urlopen(f'http://{host}:{port}/metrics') as response:
+            body = response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'operation="read_package"' in body
+
+
+def test_profiling(tmp_path):
+    homework.start_profiling()
+    try:
+        homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+        path = tmp_path / 'profile.pstats'
+        stats = homework.dump_profile(str(path))
+    finally:
+        homework.stop_profiling()
+    assert path.exists()
+    assert any(name == 'read_package'
+               for _, _, name in stats.stats), (
+        'Снимок профиля должен содержать вызов `read_package`.'
+    )
+
+
+def test_packed_roundtrip(tmp_path):
+    source = tmp_path / 'packages.jsonl'
+    source.write_text(''.join(json.dumps(package) + '\n'
+                              for package in BATCH_PACKAGES),
+                      encoding='utf-8')
+    target = tmp_path / 'packages.bin'
+    assert homework.convert_to_packed(str(source), str(target),
+                                      chunk_size=4) == len(BATCH_PACKAGES)
+    expected = sorted(
+        (homework.read_package(*package).show_training_info().get_message()
+         for package in BATCH_PACKAGES))
+    with homework.PackedFile(str(target)) as packed:
+        sections = list(packed.sections())
+        assert all(isinstance(column, memoryview)
+                   for _, columns in sections for column in columns.values())
+        messages = []
+        for _, columns in packed.compute():
+            stream = io.StringIO()
+            homework.write_columns(columns, stream)
+            messages += stream.getvalue().splitlines()
+    assert sorted(messages) == expected, (
+        'Расчёт по двоичному файлу должен совпадать с расчётом по пакетам.'
+    )
+
+
+def test_packed_file_errors(tmp_path):
+    path = tmp_path / 'broken.bin'
+    with open(path, 'wb') as file:
+        homework.write_packed(file, 'RUN', [[15000, 1, 75]])
+    path.write_bytes(path.read_bytes()[:-1])
+    with homework.PackedFile(str(path)) as packed:
+        with pytest.raises(ValueError):
+            list(packed.sections())
+    with pytest.raises(TypeError):
+        homework.write_packed(io.BytesIO(), 'RUN', [[1, 2]])
+    for code in ('CYCL', 'RW'):
+        homework.register_workout(code)(type(code, (homework.Running,), {}))
+        try:
+            with pytest.raises(ValueError):
+                homework.write_packed(io.BytesIO(), code, [[15000, 1, 75]])
+        finally:
+            homework.unregister_workout(code)
+    empty = tmp_path / 'empty.bin'
+    empty.write_bytes(b'')
+    with homework.PackedFile(str(empty)) as packed:
+        assert list(packed.sections()) == []
+
+
+def test_aggregator():
+    records = [
+        (('ann', '2024-05-01'), homework.read_package(*package))
+        for package in BATCH_PACKAGES[:4]
+    ] + [
+        (('bob', '2024-05-01'),
+         homework.read_package(*package).show_training_info())
+        for package in BATCH_PACKAGES[4:]
+    ]
+    infos = [homework.read_package(*package).show_training_info()
+             for package in BATCH_PACKAGES]
+    whole = homework.Aggregator()
+    whole.update_many(records)
+    assert len(whole) == 2
+    ann = whole[('ann', '2024-05-01')]
+    assert ann.workouts == 4
+    assert ann.by_type == {'Swimming': 1, 'Running': 2, 'SportsWalking': 1}
+    assert ann.distance == pytest.approx(
+        sum(info.distance for info in infos[:4]))
+    assert ann.mean_speed == pytest.approx(
+        sum(info.speed * info.duration for info in infos[:4])
+        / sum(info.duration for info in infos[:4])), (
+        'Средняя скорость должна взвешиваться по длительности.'
+    )
+    first, second = homework.Aggregator(), homework.Aggregator()
+    first.update_many(records[::2])
+    second.update_many(records[1::2])
+    merged = first.merge(second)
+    for key, aggregate in whole.aggregates.items():
+        assert merged[key].workouts == aggregate.workouts
+        assert merged[key].calories == pytest.approx(aggregate.calories)
+    by_day = whole.rollup(lambda key: key[1])
+    assert by_day['2024-05-01'].workouts == len(BATCH_PACKAGES)
+    restored = homework.Aggregate.from_dict(ann.to_dict())
+    assert restored.to_dict() == ann.to_dict()
+    reloaded = homework.Aggregator.from_dict(
+        json.loads(json.dumps(whole.to_dict())))
+    assert set(reloaded.aggregates) == set(whole.aggregates), (
+        'Ключи-кортежи должны переживать сериализацию в JSON.'
+    )
+    assert reloaded[('ann', '2024-05-01')].to_dict() == ann.to_dict()
+
+
+@pytest.fixture
+def user_packages(tmp_path):
+    path = tmp_path / 'packages.jsonl'
+    with open(path, 'w', encoding='utf-8') as file:
+        for index, (workout_type, data) in enumerate(BATCH_PACKAGES * 5):
+            file.write(json.dumps({'user': f'user{index % 4}',
+                                   'workout_type': workout_type,
+                                   'data': data}) + '\n')
+        file.write('["RUN", [15000, 0, 75]]\n')
+    return str(path)
+
+
+def _expected_aggregates(path, by):
+    expected = homework.Aggregator()
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if isinstance(record, list):
+                continue
+            expected.update(record['user'] if by == 'user'
+                            else record['workout_type'],
+                            homework.read_package(record['workout_type'],
+                                                  record['data']))
+    return expected
+
+
+def _assert_aggregates(result, expected):
+    assert sorted(result.aggregates) == sorted(expected.aggregates)
+    for key, aggregate in expected.aggregates.items():
+        assert result[key].workouts == aggregate.workouts
+        assert result[key].by_type == aggregate.by_type
+        assert result[key].calories == pytest.approx(aggregate.calories)
+
+
+@pytest.mark.parametrize('by', ['workout_type', 'user'])
+def test_shard_coordinator(user_packages, tmp_path, by):
+    workdir = str(tmp_path / 'work')
+    coordinator = homework.ShardCoordinator(user_packages, workdir,
+                                            shards=3, by=by)
+    result = coordinator.run(workers=2)
+    _assert_aggregates(result, _expected_aggregates(user_packages, by))
+    assert coordinator.dispatched == 3
+    assert (coordinator.stats.processed,
+            coordinator.stats.skipped) == (len(BATCH_PACKAGES) * 5, 1)
+    with open(os.path.join(workdir, 'checkpoint.json'),
+              encoding='utf-8') as file:
+        assert sorted(json.load(file)['done']) == ['0', '1', '2']
+    again = homework.ShardCoordinator(user_packages, workdir,
+                                      shards=3, by=by)
+    _assert_aggregates(again.run(workers=2),
+                       _expected_aggregates(user_packages, by))
+    assert again.dispatched == 0, (
+        'Готовые порции из контрольной точки не должны считаться заново.'
+    )
+
+
+def test_shard_coordinator_retry_and_resume(user_packages, tmp_path):
+    from multiprocessing.connection import Client
+    workdir = str(tmp_path / 'work')
+    coordinator = homework.ShardCoordinator(user_packages, workdir,
+                                            shards=2, by='user', retries=1)
+    with ThreadPoolExecutor(1) as pool:
+        running = pool.submit(coordinator.run, 0)
+        while coordinator.address[1] == 0:
+            assert not running.done()
+        with Client(coordinator.address,
+                    authkey=coordinator.authkey) as worker:
+            shard, by, lines = worker.recv()
+            worker.send((shard, homework.process_shard(lines, by)))
+            worker.recv()
+        with Client(coordinator.address,
+                    authkey=coordinator.authkey) as worker:
+            assert worker.recv() is not None, (
+                'Порция упавшего обработчика должна вернуться в очередь.'
+            )
+        with pytest.raises(RuntimeError):
+            running.result(timeout=10)
+    resumed = homework.ShardCoordinator(user_packages, workdir,
+                                        shards=2, by='user')
+    _assert_aggregates(resumed.run(workers=1),
+                       _expected_aggregates(user_packages, 'user'))
+    assert resumed.dispatched == 1
+
+
+def test_result_cache_lru():
+    cache = homework.ResultCache(maxsize=2)
+    first = cache.get('RUN', [15000, 1, 75])
+    assert cache.get('RUN', [15000.0, 1.0, 75.0]) == first
+    cache.get('WLK', [9000, 1, 75, 180])
+    cache.get('RUN', [15000, 1, 75])
+    cache.get('SWM', [720, 1, 80, 25, 40])
+    assert cache.stats() == {
+        'size': 2, 'hits': 2, 'disk_hits': 0, 'misses': 3,
+        'evictions': 1, 'hit_rate': 0.4,
+    }, 'Из кэша должна вытесняться давно не использованная запись.'
+    cache.get('WLK', [9000, 1, 75, 180])
+    assert cache.misses == 4
+
+
+@pytest.mark.parametrize('make_cache', [
+    homework.ResultCache,
+    lambda: homework.TrainingProcessor(stripes=1),
+])
+def test_result_cache_skips_non_numbers(make_cache):
+    cache = make_cache()
+    get = getattr(cache, 'get', None) or cache.process
+    get('RUN', [15000, 1, 75])
+    with pytest.raises(TypeError):
+        get('RUN', ['15000', '1', '75'])
+    get('RUN', [15000, True, 75])
+    assert cache.stats()['hits'] == 0, (
+        'Пакеты со строками и bool не должны совпадать с кэшем '
+        'корректного пакета.'
+    )
+    assert cache.stats()['size'] == 1
+
+
+def test_result_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(homework.time, 'time', lambda: now[0])
+    cache = homework.ResultCache(ttl=10)
+    cache.get('RUN', [15000, 1, 75])
+    now[0] += 5
+    cache.get('RUN', [15000, 1, 75])
+    now[0] += 20
+    cache.get('RUN', [15000, 1, 75])
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_result_cache_persistent(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    packages = BATCH_PACKAGES * 2
+    with homework.ResultCache(path=path) as cache:
+        expected = list(cache.process(packages))
+    with homework.ResultCache(path=path) as cache:
+        assert list(cache.process(packages)) == expected
+        assert cache.misses == 0, (
+            'Результаты должны читаться из файла кэша после перезапуска.'
+        )
+        assert cache.disk_hits == len(set(map(repr, BATCH_PACKAGES)))
+
+
+def test_result_cache_persistent_bounded(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(homework.time, 'time', lambda: now[0])
+    path = str(tmp_path / 'cache.sqlite')
+
+    def stored():
+        import sqlite3
+        with sqlite3.connect(path) as db:
+            return db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    with homework.ResultCache(path=path, ttl=10, disk_maxsize=3) as cache:
+        for package in BATCH_PACKAGES:
+            now[0] += 1
+            cache.get(*package)
+    assert stored() == 3, (
+        'В файле кэша должно оставаться не больше disk_maxsize записей.'
+    )
+    now[0] += 20
+    with homework.ResultCache(path=path, ttl=10, disk_maxsize=3) as cache:
+        cache.get(*BATCH_PACKAGES[-1])
+        assert cache.disk_hits == 0
+        cache.flush()
+        assert stored() == 1, 'Устаревшие записи должны удаляться из файла.'
+
+
+@pytest.fixture
+def packages_file(tmp_path):
+    path = tmp_path / 'packages.jsonl'
+    path.write_text(''.join(json.dumps(package) + '\n'
+                            for package in BATCH_PACKAGES),
+                    encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_cli_text(packages_file, workers):
+    with Capturing() as output:
+        assert homework.cli([packages_file, '-w', workers]) == 0
+    assert output == [
+        homework.read_package(*package).show_training_info().get_message()
+        for package in BATCH_PACKAGES
+    ], 'Командная строка должна печатать сообщения по порядку пакетов.'
+
+
+@pytest.mark.parametrize('output_format', ['jsonl', 'csv', 'columnar'])
+def test_cli_formats(packages_file, tmp_path, output_format):
+    target = tmp_path / f'result.{output_format}'
+    assert homework.cli([packages_file, '-f', output_format,
+                         '-o', str(target), '--chunk-size', '3']) == 0
+    if output_format == 'columnar':
+        with homework.ColumnarReader(str(target)) as reader:
+            columns = reader.read()
+        rows = [dict(zip(columns, values))
+                for values in zip(*columns.values())]
+    elif output_format == 'jsonl':
+        text = target.read_text(encoding='utf-8')
+        rows = [json.loads(line) for line in text.splitlines()]
+    else:
+        text = target.read_text(encoding='utf-8')
+        rows = list(csv.DictReader(io.StringIO(text)))
+    assert [row['training_type'] for row in rows] == [
+        homework.WORKOUT_TYPES[workout_type].__name__
+        for workout_type, _ in BATCH_PACKAGES
+    ]
+
+
+def test_cli_stats_and_errors(tmp_path, capsys):
+    path = tmp_path / 'packages.csv'
+    path.write_text('RUN,15000,1,75\nXXX,1,2\n', encoding='utf-8')
+    assert homework.cli([str(path), '--errors', 'count', '--stats']) == 0
+    captured = capsys.readouterr()
+    assert 'Записей: 1; пропущено: 1' in captured.err
+    assert homework.cli([str(path)]) == 1
+
+
+def test_cli_packed_errors(tmp_path, capsys):
+    path = tmp_path / 'packages.bin'
+    with open(path, 'wb') as file:
+        homework.write_packed(file, 'RUN', [[15000, 1, 75], [15000, 0, 75]])
+    assert homework.cli([str(path), '--errors', 'count', '--stats']) == 0
+    captured = capsys.readouterr()
+    assert captured.out == (
+        homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+        .get_message() + '\n'
+    ), 'Плохие строки двоичного файла должны отбрасываться до расчёта.'
+    assert 'Записей: 1; пропущено: 1' in captured.err
+    assert homework.cli([str(path)]) == 1
+    assert 'ZeroDivisionError' in capsys.readouterr().err
+    assert homework.cli([str(path), '-w', '2']) == 1
+
+
+def test_cli_stats_children(packages_file, capsys):
+    assert homework.cli([packages_file, '-w', '2', '--stats']) == 0
+    assert 'обработчики:' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('row_group_size', [1, 3, 100])
+def test_columnar_roundtrip(tmp_path, row_group_size):
+    path = str(tmp_path / 'results.hwcf')
+    results = [homework.read_package(*package).show_training_info()
+               for package in BATCH_PACKAGES]
+    with homework.ColumnarWriter(path, row_group_size) as writer:
+        writer.write_many(results)
+    with homework.ColumnarReader(path) as reader:
+        assert reader.num_rows == len(results)
+        assert len(reader.metadata['row_groups']) == -(
+            -len(results) // row_group_size)
+        columns = reader.read()
+        assert reader.read(['calories', 'training_type']) == {
+            'calories': columns['calories'],
+            'training_type': columns['training_type'],
+        }
+        with pytest.raises(KeyError):
+            reader.read(['pace'])
+    assert [homework.InfoMessage(*row) for row in zip(
+        *(columns[name] for name in homework.MESSAGE_FIELDS))] == results
+
+
+def test_columnar_dictionary_and_batch(tmp_path):
+    path = str(tmp_path / 'results.hwcf')
+    batch = homework.compute_batch(*homework.packages_to_columns(
+        BATCH_PACKAGES))
+    with homework.ColumnarWriter(path) as writer:
+        writer.write_columns(batch)
+    with homework.ColumnarReader(path) as reader:
+        row_group = reader.metadata['row_groups'][0]
+        training_type = row_group['columns']['training_type']
+        assert sorted(training_type['dictionary']) == [
+            'Running', 'SportsWalking', 'Swimming']
+        assert training_type['length'] == 2 * len(BATCH_PACKAGES)
+        assert reader.read() == {name: list(batch[name])
+                                 for name in homework.MESSAGE_FIELDS}
+    (tmp_path / 'bad.hwcf').write_bytes(b'not a columnar file')
+    with pytest.raises(ValueError):
+        homework.ColumnarReader(str(tmp_path / 'bad.hwcf'))
+
+
+FREE_THREADED = not getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def _hammer(processor, threads, rounds):
+    def work(offset):
+        packages = BATCH_PACKAGES[offset:] + BATCH_PACKAGES[:offset]
+        return [processor.process(*package)
+                for _ in range(rounds) for package in packages]
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(work, range(threads)))
+
+
+@pytest.mark.parametrize('free_threaded', [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(
+        not FREE_THREADED, reason='нужна сборка CPython без GIL')),
+])
+def test_training_processor_threads(free_threaded, metrics):
+    threads, rounds = (32, 200) if free_threaded else (8, 50)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        processor = homework.TrainingProcessor(stripes=4, metrics=True)
+        results = _hammer(processor, threads, rounds)
+    finally:
+        sys.setswitchinterval(interval)
+    assert not metrics.histograms, (
+        'TrainingProcessor должен писать метрики в свои Metrics потоков, '
+        'а не в глобальную METRICS.'
+    )
+    expected = [homework.read_package(*package).show_training_info()
+                for package in BATCH_PACKAGES]
+    for offset, result in enumerate(results):
+        assert result == (expected[offset:] + expected[:offset]) * rounds
+    stats = processor.stats()
+    assert stats['size'] == len(BATCH_PACKAGES)
+    assert stats['hits'] + stats['misses'] == (
+        threads * rounds * len(BATCH_PACKAGES))
+    for operation in ('read_package', 'show_training_info'):
+        assert sum(processor.metrics().count(operation, code)
+                   for code in ('SWM', 'RUN', 'WLK')) == stats['misses']
+
+
+def test_training_processor_own_table(cycling):
+    processor = homework.TrainingProcessor(cache_size=2, stripes=1)
+    homework.unregister_workout('CYC')
+    try:
+        with pytest.raises(NameError):
+            homework.read_package('CYC', [3600, 1, 75, 30])
+        assert processor.process('CYC', [3600, 1, 75, 30]).training_type == (
+            'Cycling')
+    finally:
+        homework.register_workout('CYC')(cycling)
+    for package in BATCH_PACKAGES[:3]:
+        processor.process(*package)
+    assert processor.stats()['evictions'] == 2
+    processor.remove_workout('CYC')
+    assert processor.stats()['size'] == 0
+    with pytest.raises(NameError):
+        processor.process('CYC', [3600, 1, 75, 30])
+    processor.add_workout('CYC', cycling)
+    with pytest.raises(ValueError):
+        processor.add_workout('CYC', cycling)
+    assert list(homework.TrainingProcessor(cache_size=0).process_many(
+        BATCH_PACKAGES[:2])) == [
+            homework.read_package(*package).show_training_info()
+            for package in BATCH_PACKAGES[:2]]
+
+
+def _kernel_packages(size):
+    return [package for index in range(size) for package in (
+        ('RUN', [1000 + index * 7, 1 + index % 5, 60 + index % 40]),
+        ('WLK', [900 + index * 3, 0.5 + index % 4, 55 + index % 30,
+                 150 + index % 50]),
+        ('SWM', [700 + index, 1 + index % 3, 70 + index % 25,
+                 25 + index % 2 * 25, 10 + index % 60]),
+        ('HRN', [1000 + index * 7, 1 + index % 5, 60 + index % 40]),
+    )]
+
+
+@pytest.mark.parametrize('backend', ['python', 'numpy', 'numba'])
+def test_calorie_kernels_parity(monkeypatch, backend):
+    if backend != 'python':
+        pytest.importorskip(backend)
+    monkeypatch.setattr(homework, '_KERNEL_BACKEND', None)
+    monkeypatch.setattr(homework, '_KERNELS', {})
+    assert homework.set_kernel_backend(backend) == backend
+    assert homework.kernel_backend() == backend
+
+    @homework.register_workout('HRN')
+    class HillRunning(homework.Running):
+        COEFF_CALORIES_1 = 21
+
+    try:
+        packages = _kernel_packages(homework.KERNEL_MIN_ROWS + 10)
+        result = homework.compute_batch(
+            *homework.packages_to_columns(packages))
+        expected = [homework.read_package(*package).get_spent_calories()
+                    for package in packages]
+    finally:
+        homework.unregister_workout('HRN')
+    assert result['calories'] == pytest.approx(expected, rel=1e-12), (
+        f'Формулы {backend} должны совпадать с расчётом классов.'
+    )
+
+
+def test_kernel_backend_fallback(monkeypatch):
+    monkeypatch.setattr(homework, '_KERNEL_BACKEND', None)
+    monkeypatch.setattr(homework, '_KERNELS', {})
+    monkeypatch.setitem(sys.modules, 'numba', None)
+    monkeypatch.setitem(sys.modules, 'numpy', None)
+    assert homework.kernel_backend() == 'python'
+    with pytest.raises(ImportError):
+        homework.set_kernel_backend('numpy')
+    assert homework.kernel_backend() == 'python'
+    with pytest.raises(ValueError):
+        homework.set_kernel_backend('fortran')
+
+
+IMPORT_BUDGET_US = 20_000
+LAZY_MODULES = ('argparse', 'asyncio', 'csv', 'cProfile', 'dataclasses',
+                'http.server', 'json', 'mmap', 'multiprocessing', 'numba',
+                'numpy', 'pstats', 're', 'sqlite3', 'string', 'threading',
+                'typing')
+
+
+def _import_homework(tmp_path, *options):
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=str(tmp_path))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return subprocess.run(
+        [sys.executable, *options, '-c',
+         'import sys, homework; print(" ".join(sys.modules))'],
+        cwd=str(BASE_DIR), env=env, capture_output=True, text=True,
+        check=True)
+
+
+def test_import_is_lazy(tmp_path):
+    loaded = _import_homework(tmp_path).stdout.split()
+    assert 'homework' in loaded
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    assert not eager, (
+        f'Модули {eager} должны импортироваться только при использовании.'
+    )
+
+
+def test_import_time_budget(tmp_path):
+    _import_homework(tmp_path)
+    timings = []
+    for _ in range(3):
+        stderr = _import_homework(tmp_path, '-X', 'importtime').stderr
+        cumulative = [int(line.split('|')[1])
+                      for line in stderr.splitlines()
+                      if line.rstrip().endswith('| homework')]
+        timings.append(cumulative[0])
+    assert min(timings) < IMPORT_BUDGET_US, (
+        f'Импорт homework занял {min(timings)} мкс, '
+        f'бюджет {IMPORT_BUDGET_US} мкс.'
+    )
+
+
+@pytest.mark.parametrize('workout_type, params, counters', [
+    ('RUN', {'weight': 75}, ('action',)),
+    ('WLK', {'weight': 75, 'height': 180}, ('action',)),
+    ('SWM', {'weight': 80, 'length_pool': 25}, ('action', 'count_pool')),
+])
+def test_sample_accumulator(workout_type, params, counters):
+    import random
+    generator = random.Random(7)
+    samples = {name: [generator.randint(0, 3) for _ in range(3600)]
+               for name in counters}
+    accumulator = homework.SampleAccumulator(workout_type, lap_samples=600,
+                                             **params)
+    start = 0
+    for size in (1, 999, 1000, 1600):
+        chunk = {name: values[start:start + size]
+                 for name, values in samples.items()}
+        chunk['action'] = iter(chunk['action'])
+        accumulator.feed(**chunk)
+        start += size
+    totals = {name: sum(values) for name, values in samples.items()}
+    values = {**params, **totals, 'duration': 1.0}
+    expected = homework.read_package(
+        workout_type,
+        [values[name] for name in homework.WORKOUT_TYPES[workout_type].FIELDS])
+    assert accumulator.get_distance() == expected.get_distance()
+    assert accumulator.get_mean_speed() == expected.get_mean_speed()
+    assert accumulator.get_spent_calories() == (
+        expected.get_spent_calories()), (
+        'Расчёт по отсчётам должен совпадать с расчётом по суммам.'
+    )
+    laps = accumulator.laps()
+    assert len(laps) == 6
+    assert all(lap.duration == pytest.approx(600 / 3600) for lap in laps)
+    assert sum(lap.distance for lap in laps) == pytest.approx(
+        expected.get_distance())
+
+
+def test_sample_accumulator_partial_lap_and_errors():
+    accumulator = homework.SampleAccumulator('RUN', lap_samples=4, weight=70)
+    accumulator.feed([1, 1, 1, 1, 2, 2])
+    assert [lap.duration * 3600 for lap in accumulator.laps()] == [
+        pytest.approx(4), pytest.approx(2)]
+    with pytest.raises(TypeError):
+        homework.SampleAccumulator('WLK', weight=70)
+    with pytest.raises(ValueError):
+        homework.SampleAccumulator('SWM', weight=70, length_pool=25).feed(
+            [1, 2], count_pool=[1])
+    for interval in (0, -1):
+        with pytest.raises(ValueError):
+            homework.SampleAccumulator('RUN', sample_interval=interval,
+                                       weight=70)
+    empty = homework.SampleAccumulator('RUN', lap_samples=4, weight=70)
+    assert empty.laps() == []
+    for method in (empty.show_training_info, empty.get_mean_speed,
+                   empty.get_spent_calories):
+        with pytest.raises(ValueError):
+            method()